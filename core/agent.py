@@ -1,9 +1,17 @@
-import requests
+import asyncio
+import contextvars
 import datetime
-from core.memory import MemorySystem
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.memory import MemorySystem, split_text
+from core.llm import get_client, run_sync
+from core.context import ContextManager, count_tokens
+from core.cache import SemanticCache, conversation_key
+from core import tracing
 
 class GenericAgent:
-    def __init__(self, name, description, system_prompt, collection_name, allowed_tools=None, model="qwen2.5:7b", mcp_client=None, memory_sys=None):
+    def __init__(self, name, description, system_prompt, collection_name, allowed_tools=None, model="qwen2.5:7b", mcp_client=None, memory_sys=None, llm_client=None, stream=None, context=None, response_cache=None, retrieval=None, tool_loop=None):
         self.name = name
         self.description = description
         self.system_prompt = system_prompt
@@ -11,7 +19,27 @@ class GenericAgent:
         self.model = model
         self.mcp_client = mcp_client
         self.memory_sys = memory_sys
+        self.llm = llm_client or get_client()
+        self.stream = self.llm.stream if stream is None else stream
         self.history = [{"role": "system", "content": system_prompt}]
+        # 上下文预算 (agents.yaml 中的 context 字段)
+        self.context = ContextManager(llm_client=self.llm, model=model, **(context or {}))
+        self.metrics = {"requests": 0, "prompt_tokens_est": 0, "prompt_tokens_saved": 0, "prompt_eval_count": 0,
+                        "rag_tokens_injected": 0, "rag_tokens_saved": 0,
+                        "tool_steps": 0, "tool_calls": 0, "tool_seconds": 0.0, "tool_loop_cutoffs": 0}
+        # 检索设置 (agents.yaml 中的 retrieval 字段)：距离阈值、注入 token 上限、元数据过滤
+        self.retrieval = {"n_results": 5, "max_distance": None, "max_context_tokens": None,
+                          "where": None, "max_age_days": None}
+        self.retrieval.update(retrieval or {})
+        # 工具循环 (agents.yaml 中的 tool_loop 字段)：最多 max_steps 轮工具调用，整轮对话受 time_budget 秒约束，
+        # 同一步中的多个工具调用在线程池中并行执行
+        self.tool_loop = {"max_steps": 4, "time_budget": 120, "max_parallel_tools": 4}
+        self.tool_loop.update(tool_loop or {})
+        self._tool_pool = None
+        # 语义响应缓存 (agents.yaml 中的 response_cache 字段，默认关闭)
+        self.response_cache = None
+        if response_cache and memory_sys:
+            self.response_cache = SemanticCache(memory_sys, collection_name, **response_cache)
         
         self.tools_schema = []
         self.local_tools = {}
@@ -20,31 +48,28 @@ class GenericAgent:
         if self.memory_sys:
             self._register_memory_tools()
             
-        # 注册 MCP 工具
-        if self.mcp_client and allowed_tools:
-            self._register_mcp_tools(allowed_tools)
+        # MCP 工具在首次对话时才注册 (避免为不需要工具的智能体提前启动 MCP 服务)
+        self._pending_mcp_tools = list(allowed_tools or []) if self.mcp_client else []
+        self._tools_lock = threading.Lock()
 
     def _register_memory_tools(self):
         def save_memory(content):
             try:
-                chunk_size = 500
-                if len(content) > chunk_size:
-                    chunks = [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
-                    for chunk in chunks:
-                        self.memory_sys.add_memory(chunk, metadata={"timestamp": datetime.datetime.now().isoformat(), "agent": self.name}, collection_name=self.collection_name)
+                chunks = split_text(content, 500)
+                metadata = {"timestamp": datetime.datetime.now().isoformat(), "ts": time.time(), "agent": self.name}
+                self.memory_sys.add_memories(chunks, metadata, collection_name=self.collection_name)
+                if len(chunks) > 1:
                     return f"已将长内容切片并存入【{self.name}】的知识库。"
-                else:
-                    self.memory_sys.add_memory(content, metadata={"timestamp": datetime.datetime.now().isoformat(), "agent": self.name}, collection_name=self.collection_name)
-                    return f"已存入【{self.name}】的知识库。"
+                return f"已存入【{self.name}】的知识库。"
             except Exception as e:
                 return f"存储失败: {e}"
 
         def query_memory(query):
             try:
-                results = self.memory_sys.query_memory(query, n_results=5, collection_name=self.collection_name)
+                results = self._retrieve(query)
                 if not results:
                     return "我的知识库中没有相关信息。"
-                return f"【{self.name}】检索到的知识:\n" + "\n".join([f"- {m}" for m in results])
+                return f"【{self.name}】检索到的知识:\n" + "\n".join([f"- {hit['document']}" for hit in results])
             except Exception as e:
                 return f"检索失败: {e}"
 
@@ -68,72 +93,284 @@ class GenericAgent:
             }
         })
 
+    def _retrieval_where(self):
+        conditions = [self.retrieval["where"]] if self.retrieval.get("where") else []
+        if self.retrieval.get("max_age_days"):
+            # 只有带 ts (写入时间戳) 的记忆参与按时间过滤
+            conditions.append({"ts": {"$gte": time.time() - self.retrieval["max_age_days"] * 86400}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def _retrieve(self, query):
+        """检索知识库：丢弃距离超过阈值的结果，并按 token 上限截取"""
+        cfg = self.retrieval
+        hits = self.memory_sys.search(query, n_results=cfg["n_results"], collection_name=self.collection_name,
+                                      where=self._retrieval_where())
+        kept = []
+        available = used = 0
+        for hit in hits:
+            tokens = count_tokens(hit["document"])
+            available += tokens
+            if cfg["max_distance"] is not None and hit["distance"] is not None and hit["distance"] > cfg["max_distance"]:
+                continue
+            if cfg["max_context_tokens"] and used + tokens > cfg["max_context_tokens"]:
+                continue
+            kept.append(hit)
+            used += tokens
+        self.metrics["rag_tokens_injected"] += used
+        self.metrics["rag_tokens_saved"] += available - used
+        tracing.current_span().set(hits=len(hits), hits_kept=len(kept), rag_tokens=used, rag_tokens_filtered=available - used)
+        if hits:
+            print(f"  🔎 [{self.name}] 检索: 采用 {len(kept)}/{len(hits)} 条 ({used} tokens，过滤 {available - used} tokens)")
+        return kept
+
     def _register_mcp_tools(self, allowed_tools):
         all_mcp_tools = self.mcp_client.get_ollama_tools()
         for tool in all_mcp_tools:
             if tool["function"]["name"] in allowed_tools:
                 self.tools_schema.append(tool)
 
+    def _ensure_tools(self):
+        with self._tools_lock:
+            if self._pending_mcp_tools:
+                self._register_mcp_tools(self._pending_mcp_tools)
+                self._pending_mcp_tools = []
+
+    def _ingest_tool_stream(self, func_name, args):
+        """流式读取文档并边读边入库，返回给模型的只有摘要"""
+        summary = {}
+
+        def frames():
+            summary["text"] = yield from self.mcp_client.call_tool_stream(func_name, args)
+
+        metadata = {"timestamp": datetime.datetime.now().isoformat(), "ts": time.time(), "agent": self.name}
+        stats = self.memory_sys.add_memories_stream(frames(), collection_name=self.collection_name, metadata=metadata)
+        if not stats["chunks"]:
+            return summary.get("text", "未读取到内容。")
+        return (f"{summary.get('text', '')}\n内容已读取并自动存入您的专属知识库 "
+                f"(新写入 {stats['written']} / {stats['chunks']} 个切片)。")
+
+    def _call_tool(self, func_name, args):
+        """执行单个工具 (在工具线程池中运行)"""
+        with tracing.span("agent.tool", agent=self.name, tool=func_name, args_chars=len(str(args))) as span:
+            if func_name in self.local_tools:
+                result = self.local_tools[func_name](**args)
+            elif func_name in ["read_document", "read_folder"] and self.mcp_client and self.memory_sys:
+                # 自动闭环存储：文档内容以流的形式直接进入知识库，不进入对话上下文
+                print(f"  📥 [系统] 自动将读取内容存入 {self.collection_name}...")
+                result = self._ingest_tool_stream(func_name, args)
+            elif self.mcp_client:
+                result = self.mcp_client.call_tool(func_name, args)
+            else:
+                result = f"未知的工具: {func_name}"
+            span.set(result_chars=len(str(result)))
+        return result
+
+    async def _run_tools(self, tool_calls, deadline):
+        """并行执行同一步中的全部工具调用，结果按调用顺序返回 [(工具名, 结果)]
+
+        超出本轮时间预算仍未完成的调用返回超时提示 (线程无法中断，其结果被丢弃)。
+        """
+        with self._tools_lock:
+            if self._tool_pool is None:
+                self._tool_pool = ThreadPoolExecutor(max_workers=self.tool_loop["max_parallel_tools"],
+                                                     thread_name_prefix=f"{self.name}-tool")
+        loop = asyncio.get_running_loop()
+        calls = []
+        for tool in tool_calls:
+            func_name = tool["function"]["name"]
+            args = tool["function"].get("arguments") or {}
+            print(f"  🛠️ [工具] {func_name}({str(args)[:50]}...)")
+            # 每个调用一份上下文副本，工具内的 span 挂在当前步骤下
+            ctx = contextvars.copy_context()
+            calls.append((func_name, loop.run_in_executor(self._tool_pool, ctx.run, self._call_tool, func_name, args)))
+
+        _, pending = await asyncio.wait([future for _, future in calls],
+                                        timeout=max(0.0, deadline - time.perf_counter()))
+        results = []
+        for func_name, future in calls:
+            if future in pending:
+                future.cancel()
+                results.append((func_name, f"工具 {func_name} 超出本轮时间预算 ({self.tool_loop['time_budget']}s)，已放弃等待"))
+            elif future.exception() is not None:
+                results.append((func_name, f"工具 {func_name} 执行失败: {future.exception()}"))
+            else:
+                results.append((func_name, str(future.result())))
+        return results
+
+    def new_history(self):
+        """新会话的初始 history (服务模式下每个会话各持一份)"""
+        return [{"role": "system", "content": self.system_prompt}]
+
     def chat(self, user_input, history_context=None):
+        return run_sync(self.achat(user_input, history_context))
+
+    async def achat(self, user_input, history_context=None, history=None):
+        tokens = []
+        async for token in self.astream(user_input, history_context, history):
+            tokens.append(token)
+        return "".join(tokens)
+
+    async def _fit_context(self, history):
+        """按预算压缩 history (原地替换，保持 payload 引用有效)，返回压缩统计"""
+        history[:], stats = await asyncio.to_thread(self.context.fit_with_stats, history)
+        return stats
+
+    def _record_prompt_tokens(self, data, stats):
+        self.metrics["requests"] += 1
+        self.metrics["prompt_tokens_est"] += stats.get("after", 0)
+        self.metrics["prompt_tokens_saved"] += stats.get("saved", 0)
+        self.metrics["prompt_eval_count"] += data.get("prompt_eval_count") or 0
+        actual = data.get("prompt_eval_count")
+        print(f"  📏 [{self.name}] 提示 tokens: 估算 {stats.get('after', 0)} (压缩前 {stats.get('before', 0)})"
+              + (f"，实际 {actual}" if actual is not None else ""))
+
+    async def _generate(self, payload):
+        """调用 LLM 并边收边打印；产出内容 token，最后产出完整响应"""
+        with tracing.span("agent.llm", agent=self.name, model=self.model, stream=bool(payload.get("stream"))) as span:
+            stats = await self._fit_context(payload["messages"])
+            span.set(prompt_tokens_est=stats.get("after", 0), prompt_messages=len(payload["messages"]),
+                     prompt_chars=sum(len(str(m.get("content") or "")) for m in payload["messages"]))
+            started = False
+            async for event in self.llm.chat_events(payload):
+                if isinstance(event, str):
+                    if not started:
+                        print(f"🗣️ [{self.name}]: ", end="", flush=True)
+                        started = True
+                    print(event, end="", flush=True)
+                else:
+                    if started:
+                        print()
+                    if event.get("ttft") is not None:
+                        print(f"  ⏱️ [{self.name}] 首 token 延迟: {event['ttft'] * 1000:.0f} ms")
+                        span.set(ttft_ms=event["ttft"] * 1000)
+                    self._record_prompt_tokens(event, stats)
+                    message = event.get("message", {})
+                    span.set(load_ms=(event.get("load_duration") or 0) / 1e6,
+                             prompt_eval_count=event.get("prompt_eval_count") or 0,
+                             eval_count=event.get("eval_count") or 0,
+                             output_chars=len(message.get("content") or ""),
+                             tool_calls=len(message.get("tool_calls") or []))
+                yield event
+
+    async def astream(self, user_input, history_context=None, history=None, raise_errors=False, cache_context=None):
+        """流式对话：逐个产出回复 token，结束后把完整回复写入 history
+
+        history 为会话自己的消息列表 (服务模式)；不传时使用智能体自带的 self.history。
+        raise_errors=True 时异常直接抛给调用方，否则以 "发生错误" 作为回复。
+        cache_context 是语义缓存的对话上下文 (编排器按整个会话计算)；不传时按本智能体的 history 计算。
+        """
+        with tracing.span("agent.chat", agent=self.name, input_chars=len(user_input)) as span:
+            output_chars = 0
+            async for token in self._astream(user_input, history_context, history, raise_errors, cache_context):
+                output_chars += len(token)
+                yield token
+            span.set(output_chars=output_chars)
+
+    async def _astream(self, user_input, history_context, history, raise_errors=False, cache_context=None):
+        history = self.history if history is None else history
         print(f"\n🤖 [{self.name}] 接管任务...")
-        
+        if self._pending_mcp_tools:
+            await asyncio.to_thread(self._ensure_tools)
+
+        # 语义缓存：相似问题直接返回历史回答。缓存由所有会话共享，条目按此前的用户发言分区，
+        # "继续" 之类依赖上下文的追问只会命中上下文相同的对话
+        started_at = time.perf_counter()
+        cache_entry = None
+        if cache_context is None:
+            cache_context = conversation_key(history)
+        if self.response_cache:
+            try:
+                version = self.memory_sys.collection_version(self.collection_name)
+                with tracing.span("agent.cache_lookup", agent=self.name) as span:
+                    answer, vector = await asyncio.to_thread(self.response_cache.lookup, user_input, cache_context)
+                    span.set(hit=answer is not None)
+            except Exception as e:
+                print(f"  ⚠️ 语义缓存不可用: {e}")
+            else:
+                if answer is not None:
+                    print(f"  ⚡ [{self.name}] 语义缓存命中，跳过检索与生成")
+                    print(f"🗣️ [{self.name}]: {answer}")
+                    history.append({"role": "user", "content": user_input})
+                    history.append({"role": "assistant", "content": answer})
+                    yield answer
+                    return
+                cache_entry = (vector, version)
+
         if history_context:
-            self.history.append({"role": "system", "content": f"任务背景(来自Manager): {history_context}"})
+            history.append({"role": "system", "content": f"任务背景(来自Manager): {history_context}"})
             
-        self.history.append({"role": "user", "content": user_input})
+        history.append({"role": "user", "content": user_input})
         
         # 自动检索 (RAG)
         if "query_memory" in self.local_tools:
-            memories = self.local_tools["query_memory"](user_input)
+            with tracing.span("agent.rag", agent=self.name, collection=self.collection_name):
+                memories = await asyncio.to_thread(self.local_tools["query_memory"], user_input)
             if "没有相关信息" not in memories:
-                self.history.append({"role": "system", "content": f"相关背景知识:\n{memories}"})
+                history.append({"role": "system", "content": f"相关背景知识:\n{memories}"})
 
         payload = {
             "model": self.model,
-            "messages": self.history,
+            "messages": history,
             "tools": self.tools_schema,
-            "stream": False
+            "stream": self.stream
         }
         
-        api_url = "http://localhost:11434/api/chat"
+        max_steps = self.tool_loop["max_steps"]
+        budget = self.tool_loop.get("time_budget")
+        deadline = started_at + budget if budget else float("inf")
         try:
-            response = requests.post(api_url, json=payload)
-            response.raise_for_status()
-            message = response.json().get("message", {})
-
-            if message.get("tool_calls"):
-                self.history.append(message)
-                for tool in message["tool_calls"]:
-                    func_name = tool["function"]["name"]
-                    args = tool["function"]["arguments"]
-                    print(f"  🛠️ [工具] {func_name}({str(args)[:50]}...)")
-                    
-                    result = ""
-                    if func_name in self.local_tools:
-                        result = self.local_tools[func_name](**args)
-                    elif self.mcp_client:
-                        result = self.mcp_client.call_tool(func_name, args)
-                    
-                    # 自动闭环存储
-                    if func_name in ["read_document", "read_folder"]:
-                        print(f"  📥 [系统] 自动将读取内容存入 {self.collection_name}...")
-                        self.local_tools["save_memory"](result)
-                        result = "内容已读取并自动存入您的专属知识库。"
-
-                    self.history.append({"role": "tool", "content": str(result)})
-
-                # 递归获取回复
-                payload["messages"] = self.history
-                response = requests.post(api_url, json=payload)
-                final_msg = response.json().get("message", {}).get("content", "")
-                print(f"🗣️ [{self.name}]: {final_msg}")
-                self.history.append({"role": "assistant", "content": final_msg})
-                return final_msg
-            else:
-                content = message.get("content", "")
-                print(f"🗣️ [{self.name}]: {content}")
-                self.history.append(message)
-                return content
+            # 工具循环：模型每返回一批 tool_calls 算一步，并行执行后把结果交回模型，直到给出最终回答
+            step = 0
+            while True:
+                can_use_tools = step < max_steps and time.perf_counter() < deadline
+                if can_use_tools:
+                    payload["tools"] = self.tools_schema
+                else:
+                    # 步数或时间预算用尽：不再提供工具，要求模型基于已有结果作答
+                    payload.pop("tools", None)
+                    if step:
+                        self.metrics["tool_loop_cutoffs"] += 1
+                        print(f"  ⛔ [{self.name}] 工具循环已达上限 ({step} 步 / {time.perf_counter() - started_at:.1f}s)，生成最终回答")
+
+                with tracing.span("agent.step", agent=self.name, step=step + 1) as span:
+                    step_started = time.perf_counter()
+                    message = {}
+                    async for event in self._generate(payload):
+                        if isinstance(event, str):
+                            yield event
+                        else:
+                            message = event.get("message", {})
+                    llm_seconds = time.perf_counter() - step_started
+                    span.set(llm_ms=llm_seconds * 1000)
+
+                    if not can_use_tools or not message.get("tool_calls"):
+                        final_msg = message.get("content", "")
+                        history.append({"role": "assistant", "content": final_msg} if message.get("tool_calls") else message)
+                        break
+
+                    history.append(message)
+                    step += 1
+                    tool_started = time.perf_counter()
+                    results = await self._run_tools(message["tool_calls"], deadline)
+                    tool_seconds = time.perf_counter() - tool_started
+                    for func_name, result in results:
+                        history.append({"role": "tool", "tool_name": func_name, "content": result})
+                    span.set(tools=len(results), tools_ms=tool_seconds * 1000)
+
+                self.metrics["tool_steps"] += 1
+                self.metrics["tool_calls"] += len(results)
+                self.metrics["tool_seconds"] += tool_seconds
+                print(f"  ⏱️ [{self.name}] 第 {step} 步: LLM {llm_seconds * 1000:.0f} ms，"
+                      f"{len(results)} 个工具并行 {tool_seconds * 1000:.0f} ms")
+
+            if cache_entry:
+                vector, version = cache_entry
+                self.response_cache.put(user_input, final_msg, vector, version, time.perf_counter() - started_at,
+                                        cache_context)
         except Exception as e:
             print(f"Error: {e}")
-            return "发生错误"
+            if raise_errors:
+                raise
+            yield "发生错误"
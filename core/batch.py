@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import time
+
+from core.session import Session
+
+# === JSONL 批量运行 ===
+# 逐行读取请求文件，按并发度交给 Orchestrator 处理，结果逐条追加到输出文件；
+# 输出文件本身就是检查点：重新运行时跳过其中已完成的请求
+
+MESSAGE_FIELDS = ("message", "prompt", "input", "question", "body")
+ID_FIELDS = ("id", "request_id")
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+def request_id(record, index):
+    for key in ID_FIELDS:
+        if record.get(key) is not None:
+            return str(record[key])
+    return f"line-{index}"
+
+def request_message(record, field=None):
+    if field:
+        return str(record.get(field) or "")
+    for key in MESSAGE_FIELDS:
+        if record.get(key):
+            if key == "body" and record.get("title"):
+                return f"{record['title']}\n{record['body']}"
+            return str(record[key])
+    return ""
+
+def load_checkpoint(output_path):
+    """读取已成功完成的请求 id (失败的请求会在续跑时重试)；崩溃留下的半行记录会被截掉"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_bytes = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                rid = record["id"]
+            except (ValueError, KeyError):
+                break
+            if "error" not in record:
+                done.add(rid)
+            valid_bytes += len(line)
+    if valid_bytes != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+class BatchRunner:
+    def __init__(self, orchestrator, concurrency=8, field=None, fsync_every=16):
+        self.orchestrator = orchestrator
+        self.concurrency = concurrency
+        self.field = field
+        self.fsync_every = fsync_every
+        self.latencies = []
+        self.by_agent = {}
+        self.stats = {"total": 0, "skipped": 0, "completed": 0, "failed": 0}
+
+    def _read(self, input_path, done):
+        with open(input_path, "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"  ⚠️ 第 {index + 1} 行不是合法的 JSON，已跳过")
+                    continue
+                self.stats["total"] += 1
+                rid = request_id(record, index)
+                if rid in done:
+                    self.stats["skipped"] += 1
+                    continue
+                yield index, rid, request_message(record, self.field)
+
+    async def _process(self, index, rid, message):
+        session = Session(rid)
+        started = time.perf_counter()
+        result = {"id": rid, "index": index, "input": message}
+        try:
+            if not message:
+                raise ValueError("请求中没有可用的消息字段")
+            result["reply"] = await self.orchestrator.aprocess(message, session, raise_errors=True)
+            result["agent"] = session.last_agent
+        except Exception as e:
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        return result
+
+    async def run(self, input_path, output_path):
+        done = load_checkpoint(output_path)
+        if done:
+            print(f"📌 检查点: 已完成 {len(done)} 条，从中断处继续")
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        started = time.perf_counter()
+
+        with open(output_path, "a", encoding="utf-8") as out:
+            written = 0
+
+            def write(result):
+                nonlocal written
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                written += 1
+                if written % self.fsync_every == 0:
+                    os.fsync(out.fileno())
+
+            async def worker():
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    result = await self._process(*item)
+                    write(result)
+                    if "error" in result:
+                        self.stats["failed"] += 1
+                    else:
+                        self.stats["completed"] += 1
+                        self.latencies.append(result["seconds"])
+                        agent = result.get("agent") or "unknown"
+                        self.by_agent[agent] = self.by_agent.get(agent, 0) + 1
+
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            # 输入文件边读边入队 (队列有界，不会把整个文件读进内存)
+            for item in self._read(input_path, done):
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            os.fsync(out.fileno())
+
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        processed = self.stats["completed"] + self.stats["failed"]
+        return dict(
+            self.stats,
+            seconds=round(elapsed, 3),
+            throughput=processed / elapsed if elapsed > 0 else 0.0,
+            p50=percentile(self.latencies, 0.50),
+            p95=percentile(self.latencies, 0.95),
+            p99=percentile(self.latencies, 0.99),
+            by_agent=self.by_agent
+        )
+
+def print_report(report):
+    print("-" * 50)
+    print(f"📊 批量运行完成: 共 {report['total']} 条，本次完成 {report['completed']}，失败 {report['failed']}，"
+          f"跳过 (已完成) {report['skipped']}")
+    print(f"   吞吐 {report['throughput']:.2f} req/s，耗时 {report['seconds']:.1f}s，"
+          f"延迟 p50 {report['p50']:.2f}s / p95 {report['p95']:.2f}s / p99 {report['p99']:.2f}s")
+    print("   路由: " + ", ".join(f"{name} {count}" for name, count in sorted(report["by_agent"].items())))
@@ -0,0 +1,102 @@
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# === 语义响应缓存 ===
+# 相似问题直接返回历史回答，跳过 RAG 与 LLM 生成；智能体的知识库一旦写入，旧回答全部失效。
+# 条目按对话上下文分区：只有之前的用户发言完全相同时才会复用，"继续" 之类的追问不会拿到别的对话的回答
+
+def conversation_key(history):
+    """会话中此前全部用户发言的摘要；对话的第一轮为空字符串"""
+    turns = [str(m.get("content") or "") for m in history if m.get("role") == "user"]
+    if not turns:
+        return ""
+    return hashlib.sha256("\0".join(turns).encode("utf-8")).hexdigest()
+
+class SemanticCache:
+    def __init__(self, memory_sys, collection_name, threshold=0.92, ttl=3600, max_items=256):
+        self.memory_sys = memory_sys
+        self.collection_name = collection_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        # key -> {"query", "context", "answer", "vector", "created", "version", "latency"}，按最近使用排序
+        self._entries = OrderedDict()
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "evictions": 0,
+                      "expirations": 0, "invalidations": 0, "latency_saved": 0.0}
+
+    def embed(self, query):
+        vector = np.asarray(self.memory_sys.embed(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query, context=""):
+        """返回 (命中的回答或 None, 查询向量)；查询向量可在未命中时交给 put 复用
+
+        context 为 conversation_key 的结果，只与相同上下文写入的条目比较。
+        """
+        vector = self.embed(query)
+        version = self.memory_sys.collection_version(self.collection_name)
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._drop_stale(version, now)
+            best_key, best_score = None, self.threshold
+            for key, entry in self._entries.items():
+                if entry["context"] != context:
+                    continue
+                score = float(entry["vector"] @ vector)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.stats["misses"] += 1
+                return None, vector
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            self.stats["latency_saved"] += entry["latency"]
+            return entry["answer"], vector
+
+    def put(self, query, answer, vector, version, latency, context=""):
+        """写入一条回答；version 是生成开始前的集合版本 (生成期间知识库被写入则该条目随即失效)"""
+        if not answer:
+            return
+        with self._lock:
+            self._entries[next(self._keys)] = {
+                "query": query,
+                "context": context,
+                "answer": answer,
+                "vector": vector,
+                "created": time.time(),
+                "version": version,
+                "latency": latency
+            }
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _drop_stale(self, version, now):
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if entry["version"] != version:
+                del self._entries[key]
+                self.stats["invalidations"] += 1
+            elif self.ttl and now - entry["created"] > self.ttl:
+                del self._entries[key]
+                self.stats["expirations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return dict(self.stats, size=len(self._entries),
+                        hit_rate=self.stats["hits"] / lookups if lookups else 0.0)
@@ -0,0 +1,145 @@
+import json
+
+# === 对话上下文管理 ===
+# 按 token 预算裁剪 history：滑动窗口 + 早期对话滚动摘要，并清理过期的 RAG / 工具载荷
+
+RAG_PREFIX = "相关背景知识"
+MANAGER_PREFIX = "任务背景(来自Manager)"
+SUMMARY_PREFIX = "早前对话摘要"
+STALE_TOOL_CHARS = 200  # 历史轮次中的工具结果超过该长度时替换为占位符
+
+def count_tokens(text):
+    """粗略估算 token 数：CJK 字符约 1 token/字，其余约 4 字符/token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "⺀" <= ch <= "鿿" or "가" <= ch <= "힯" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+def message_tokens(message):
+    tokens = 4 + count_tokens(str(message.get("content") or ""))
+    if message.get("tool_calls"):
+        tokens += count_tokens(json.dumps(message["tool_calls"], ensure_ascii=False))
+    return tokens
+
+def _is_system_note(message, prefix):
+    return message.get("role") == "system" and str(message.get("content", "")).startswith(prefix)
+
+def _split_turns(messages):
+    """按用户发言切分轮次；Manager 背景消息归入紧随其后的那一轮"""
+    turns = []
+    for message in messages:
+        follows_note = bool(turns) and _is_system_note(turns[-1][-1], MANAGER_PREFIX)
+        starts_turn = _is_system_note(message, MANAGER_PREFIX) or (message.get("role") == "user" and not follows_note)
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+def _strip_stale(turn):
+    """去掉已结束轮次中只对当轮有用的载荷"""
+    kept = []
+    for message in turn:
+        if _is_system_note(message, RAG_PREFIX) or _is_system_note(message, MANAGER_PREFIX):
+            continue
+        if message.get("role") == "tool" and len(str(message.get("content", ""))) > STALE_TOOL_CHARS:
+            message = dict(message, content=f"[工具结果已省略，原长度 {len(str(message['content']))} 字符]")
+        kept.append(message)
+    return kept
+
+class ContextManager:
+    def __init__(self, budget=4096, keep_recent_turns=4, summary_max_chars=1500,
+                 summarize_with_llm=False, llm_client=None, model=None):
+        self.budget = budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summary_max_chars = summary_max_chars
+        self.summarize_with_llm = summarize_with_llm and llm_client is not None
+        self.llm = llm_client
+        self.model = model
+        self.last_stats = {}
+
+    def fit(self, history):
+        """返回满足预算的新 history；最后一轮 (正在进行的对话) 始终完整保留"""
+        return self.fit_with_stats(history)[0]
+
+    def fit_with_stats(self, history):
+        """同 fit，另外返回本次的统计 (多个会话并发共用同一个 ContextManager 时使用)"""
+        before = sum(message_tokens(m) for m in history)
+
+        head = []
+        rest = list(history)
+        if rest and rest[0].get("role") == "system" and not _is_system_note(rest[0], SUMMARY_PREFIX):
+            head.append(rest.pop(0))
+        summary = ""
+        if rest and _is_system_note(rest[0], SUMMARY_PREFIX):
+            summary = rest.pop(0)["content"][len(SUMMARY_PREFIX) + 1:].strip()
+
+        turns = _split_turns(rest)
+        turns = [_strip_stale(t) for t in turns[:-1]] + turns[-1:]
+
+        def total():
+            tokens = sum(message_tokens(m) for m in head)
+            if summary:
+                tokens += message_tokens({"content": summary}) + count_tokens(SUMMARY_PREFIX)
+            return tokens + sum(message_tokens(m) for t in turns for m in t)
+
+        # 超出预算或超出窗口时，把最早的轮次并入摘要
+        folded = []
+        while len(turns) > 1 and (total() > self.budget or len(turns) > self.keep_recent_turns):
+            folded.append(turns.pop(0))
+        if folded:
+            summary = self._summarize(summary, folded)
+
+        # 最后手段：当前轮中的大段工具结果 / 检索内容按剩余预算截断
+        if total() > self.budget and turns:
+            self._truncate_turn(turns[-1], total() - self.budget)
+
+        fitted = list(head)
+        if summary:
+            fitted.append({"role": "system", "content": f"{SUMMARY_PREFIX}:\n{summary}"})
+        for turn in turns:
+            fitted.extend(turn)
+
+        after = sum(message_tokens(m) for m in fitted)
+        stats = {"before": before, "after": after, "saved": before - after, "folded_turns": len(folded)}
+        self.last_stats = stats
+        return fitted, stats
+
+    def _truncate_turn(self, turn, excess):
+        candidates = sorted(
+            (i for i, m in enumerate(turn) if m.get("role") == "tool" or _is_system_note(m, RAG_PREFIX)),
+            key=lambda i: -len(str(turn[i].get("content", "")))
+        )
+        for i in candidates:
+            if excess <= 0:
+                break
+            content = str(turn[i].get("content", ""))
+            tokens = count_tokens(content)
+            keep_ratio = max(0.0, (tokens - excess) / tokens) if tokens else 0.0
+            keep_chars = int(len(content) * keep_ratio)
+            turn[i] = dict(turn[i], content=content[:keep_chars] + f"\n[内容过长，已截断 {len(content) - keep_chars} 字符]")
+            excess -= tokens - count_tokens(turn[i]["content"])
+
+    def _summarize(self, summary, turns):
+        lines = []
+        for turn in turns:
+            for message in turn:
+                content = str(message.get("content") or "").strip().replace("\n", " ")
+                if message.get("role") == "user":
+                    lines.append(f"用户: {content[:100]}")
+                elif message.get("role") == "assistant" and content:
+                    lines.append(f"助手: {content[:100]}")
+        if self.summarize_with_llm and lines:
+            try:
+                data = self.llm.chat_sync({
+                    "model": self.model,
+                    "messages": [
+                        {"role": "system", "content": "请把以下对话压缩为简洁的要点摘要，保留事实、结论和未完成的任务。"},
+                        {"role": "user", "content": (summary + "\n" if summary else "") + "\n".join(lines)}
+                    ],
+                    "stream": False
+                })
+                return data.get("message", {}).get("content", "").strip()[-self.summary_max_chars:]
+            except Exception as e:
+                print(f"  ⚠️ 摘要生成失败，改用截取摘要: {e}")
+        merged = "\n".join(filter(None, [summary] + lines))
+        return merged[-self.summary_max_chars:]
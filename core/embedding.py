@@ -0,0 +1,168 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future
+
+from core.tracing import BUCKETS
+
+# === 嵌入微批引擎 ===
+# 所有智能体与会话共享同一个嵌入模型；并发的编码请求在很短的时间窗口内合并成一个批次，
+# 由专用工作线程做一次前向计算后按请求拆分结果，批处理才是 transformer 吞吐量的来源
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+ONNX_FILE = "onnx/model_qint8_avx2.onnx"
+
+def load_model(model_name, backend="torch", onnx_file=ONNX_FILE):
+    """加载 SentenceTransformer；backend="onnx" 时使用 ONNX Runtime (默认 int8 量化的 CPU 模型)
+
+    需要 sentence-transformers>=3.2 与 onnxruntime (pip install "sentence-transformers[onnx]")，
+    不满足时打印提示并回退到 PyTorch 后端。返回 (model, 实际使用的后端)
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        try:
+            model_kwargs = {"file_name": onnx_file} if onnx_file else {}
+            return SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs), "onnx"
+        except Exception as e:  # 旧版 sentence-transformers 不认识 backend 参数，或缺少 onnxruntime / optimum
+            print(f"  ⚠️ ONNX 嵌入后端不可用，回退到 PyTorch: {e}")
+    elif backend != "torch":
+        raise ValueError(f"未知的嵌入后端: {backend}")
+    return SentenceTransformer(model_name), "torch"
+
+def _histogram(buckets, samples):
+    counts = [0] * (len(buckets) + 1)
+    for value in samples:
+        counts[bisect_left(buckets, value)] += 1
+    total = 0
+    result = {}
+    for bound, count in zip([str(b) for b in buckets] + ["+Inf"], counts):
+        total += count
+        result[bound] = total
+    return result
+
+class _Request:
+    __slots__ = ("texts", "future", "submitted")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+class EmbeddingEngine:
+    def __init__(self, encode, batch_window_ms=5, max_batch=64, history=2000):
+        """encode: 文本列表 -> 向量数组 (通常是 SentenceTransformer.encode)
+        batch_window_ms: 收到第一个请求后继续等待其他请求加入的时长；0 表示只合并已在排队的请求。
+            上一批只有一个请求时 (串行调用) 不等待，避免给单个调用方白白增加延迟
+        max_batch: 一个批次最多合并的文本数，也是模型的前向批大小 (单个请求超过该值时独立成批)
+        """
+        self.encode_fn = encode
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._closed = False
+        self._last_requests = 0
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "errors": 0, "encode_seconds": 0.0}
+        self.batch_sizes = deque(maxlen=history)
+        self.latencies = deque(maxlen=history)
+
+    def submit(self, texts):
+        """提交一组文本，返回 Future (结果为与 texts 对齐的向量列表)"""
+        request = _Request(list(texts))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("嵌入引擎已关闭")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+            self._queue.append(request)
+            self._cond.notify()
+        return request.future
+
+    def encode(self, texts):
+        """阻塞等待所在批次完成"""
+        return self.submit(texts).result()
+
+    def _collect(self):
+        """等到第一个请求后，在时间窗口内继续合并请求，直到达到 max_batch"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            batch = [self._queue.popleft()]
+            size = len(batch[0].texts)
+            window = self.batch_window if self._last_requests > 1 or self._queue else 0
+            deadline = time.perf_counter() + window
+            while size < self.max_batch:
+                if not self._queue:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or self._closed:
+                        break
+                    self._cond.wait(remaining)
+                    continue
+                if size + len(self._queue[0].texts) > self.max_batch:
+                    break
+                request = self._queue.popleft()
+                batch.append(request)
+                size += len(request.texts)
+            self._last_requests = len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._process(batch)
+
+    def _process(self, batch):
+        # 不同请求里的相同文本只编码一次
+        unique = list(dict.fromkeys(text for request in batch for text in request.texts))
+        start = time.perf_counter()
+        try:
+            encoded = self.encode_fn(unique, batch_size=self.max_batch) if unique else []
+            lookup = dict(zip(unique, encoded.tolist() if hasattr(encoded, "tolist") else list(encoded)))
+        except Exception as e:
+            self.stats["errors"] += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        finished = time.perf_counter()
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        self.stats["texts"] += len(unique)
+        self.stats["encode_seconds"] += finished - start
+        self.batch_sizes.append(len(unique))
+        for request in batch:
+            self.latencies.append(finished - request.submitted)
+            request.future.set_result([lookup[text] for text in request.texts])
+
+    def close(self):
+        """处理完已排队的请求后停止工作线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+
+    def metrics(self):
+        sizes = list(self.batch_sizes)
+        latencies = sorted(self.latencies)
+        latency = {}
+        if latencies:
+            latency = {
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            }
+        return dict(
+            self.stats,
+            queued=len(self._queue),
+            avg_batch=sum(sizes) / len(sizes) if sizes else 0.0,
+            batch_histogram=_histogram(BATCH_BUCKETS, sizes),
+            latency=latency,
+            latency_histogram=_histogram(BUCKETS, latencies)
+        )
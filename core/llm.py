@@ -0,0 +1,259 @@
+import asyncio
+import contextlib
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# === 共享 LLM 客户端 ===
+# 所有对 Ollama 的调用都经过这里：连接复用、超时、失败重试，以及 asyncio 接口
+
+DEFAULT_BASE_URL = "http://localhost:11434"
+RETRY_STATUS = {429, 502, 503, 504}
+_STREAM_END = object()
+
+class LLMClient:
+    def __init__(self, base_url=DEFAULT_BASE_URL, connect_timeout=5, read_timeout=300,
+                 max_retries=3, backoff=0.5, pool_size=16, stream=False, max_concurrent=None, keep_alive=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        # 默认是否流式输出 (智能体可单独覆盖)
+        self.stream = stream
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # 阻塞的 HTTP 调用在专用线程池中执行，事件循环本身不被占用
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llm")
+        # 同时在途的生成请求上限 (多会话服务时保护 Ollama 主机)，超出的请求在线程中排队等待
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.stats = {"requests": 0, "retries": 0, "errors": 0, "in_flight": 0, "waiting": 0}
+        # 计数器在 to_thread / 执行器线程中更新，读改写需要加锁
+        self._stats_lock = threading.Lock()
+        self.ttft_samples = deque(maxlen=1000)
+        # 每个请求附带的 keep_alive (如 "30m")，让模型在两次请求之间保持加载
+        self.keep_alive = keep_alive
+        # 模型常驻管理 (core.models.ModelManager)：记录请求命中的模型是否已加载
+        self.models = None
+
+    def _prepare(self, payload):
+        if self.keep_alive is not None and "keep_alive" not in payload:
+            payload = dict(payload, keep_alive=self.keep_alive)
+        if self.models is not None:
+            self.models.on_request(payload.get("model"))
+        return payload
+
+    def _observe(self, payload, data):
+        if self.models is not None:
+            self.models.on_response(payload.get("model"), data)
+
+    def _count(self, key, delta=1):
+        with self._stats_lock:
+            self.stats[key] += delta
+
+    def _post(self, path, payload, stream=False):
+        url = f"{self.base_url}{path}"
+        self._count("requests")
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+                if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                    response.close()
+                    raise requests.ConnectionError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                return response
+            except (requests.ConnectionError, requests.exceptions.ConnectTimeout):
+                if attempt >= self.max_retries:
+                    self._count("errors")
+                    raise
+                self._count("retries")
+                time.sleep(self.backoff * (2 ** attempt))
+            except requests.RequestException:
+                self._count("errors")
+                raise
+
+    @contextlib.contextmanager
+    def _slot(self):
+        if self._slots is not None:
+            self._count("waiting")
+            self._slots.acquire()
+            self._count("waiting", -1)
+        self._count("in_flight")
+        try:
+            yield
+        finally:
+            self._count("in_flight", -1)
+            if self._slots is not None:
+                self._slots.release()
+
+    def chat_sync(self, payload):
+        """同步调用 /api/chat，返回解析后的 JSON"""
+        payload = self._prepare(payload)
+        with self._slot():
+            data = self._post("/api/chat", payload).json()
+        self._observe(payload, data)
+        return data
+
+    async def chat(self, payload):
+        """异步调用 /api/chat，多个请求可以同时在途"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.chat_sync, payload)
+
+    def _iter_stream(self, payload, stop=None, opened=None):
+        """逐块产出 NDJSON；整个流读完 (或 stop 被设置) 之前一直占用并发名额
+
+        opened(response) 在响应建立后回调，调用方可借此从其他线程关闭连接以打断阻塞的读取。
+        """
+        payload = self._prepare(payload)
+        with self._slot():
+            response = self._post("/api/chat", payload, stream=True)
+            if opened is not None:
+                opened(response)
+            with response:
+                for line in response.iter_lines():
+                    if stop is not None and stop.is_set():
+                        return
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get("done"):
+                            self._observe(payload, chunk)
+                        yield chunk
+
+    async def chat_stream(self, payload):
+        """异步流式调用 /api/chat，NDJSON 块到达即产出"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        # 消费者提前退出 (生成器被关闭 / 任务取消) 时通知读取线程停止，并关闭连接、归还并发名额
+        stop = threading.Event()
+        responses = []
+
+        def emit(item):
+            if stop.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # 事件循环已关闭，消费者不再需要数据
+
+        def opened(response):
+            responses.append(response)
+            if stop.is_set():
+                response.close()
+
+        def pump():
+            try:
+                with contextlib.closing(self._iter_stream(payload, stop, opened)) as chunks:
+                    for chunk in chunks:
+                        emit(chunk)
+            except Exception as e:
+                emit(e)
+            finally:
+                emit(_STREAM_END)
+
+        loop.run_in_executor(self._executor, pump)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            for response in responses:
+                # 打断读取线程中阻塞的 iter_lines，使其尽快释放名额
+                response.close()
+
+    async def chat_events(self, payload):
+        """统一的调用入口：先逐个产出内容 token (str)，最后产出完整响应 (dict)
+
+        流式模式下工具调用与内容会在流结束后拼装成一条完整 message，
+        非流式模式下整段内容作为唯一的 token 产出。
+        """
+        if not payload.get("stream"):
+            data = await self.chat(payload)
+            content = data.get("message", {}).get("content")
+            if content:
+                yield content
+            yield data
+            return
+
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        tool_calls = []
+        role = "assistant"
+        final = {}
+        async for chunk in self.chat_stream(payload):
+            message = chunk.get("message", {})
+            role = message.get("role", role)
+            if message.get("tool_calls"):
+                tool_calls.extend(message["tool_calls"])
+            content = message.get("content")
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    self.ttft_samples.append(first_token)
+                parts.append(content)
+                yield content
+            if chunk.get("done"):
+                final = chunk
+
+        message = {"role": role, "content": "".join(parts)}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        data = dict(final)
+        data["message"] = message
+        data["ttft"] = first_token
+        yield data
+
+    def metrics(self):
+        samples = sorted(self.ttft_samples)
+        ttft = {}
+        if samples:
+            ttft = {
+                "count": len(samples),
+                "last": self.ttft_samples[-1],
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            }
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, ttft=ttft)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def configure(**kwargs):
+    """按配置 (agents.yaml 的 llm 段) 重建默认客户端"""
+    global _default_client
+    with _default_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = LLMClient(**kwargs)
+        return _default_client
+
+def get_client():
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
+
+def run_sync(coro):
+    """在同步代码 (REPL) 中执行协程；已有事件循环时请直接 await"""
+    return asyncio.run(coro)
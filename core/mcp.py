@@ -1,40 +1,387 @@
+import asyncio
+import itertools
 import json
+import os
+import queue
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import Future
+from core import tracing
 
-class MCPClient:
-    def __init__(self, script_path):
-        self.process = subprocess.Popen(
-            [sys.executable, script_path],
+_STREAM_END = object()
+
+class _ToolStream:
+    """一次流式工具调用的接收端：帧队列 + 最终响应
+
+    背压靠信用额度实现：服务端最多发出 window 个未确认的帧，消费者取走帧后分批 ack，
+    因此队列长度不超过 window，读取线程 push 时也从不阻塞 (不会拖住同一进程上的其他请求)。
+    """
+    def __init__(self, window):
+        self.window = window
+        self.frames = queue.Queue()
+        self.closed = False
+
+    def push(self, item):
+        # 消费者放弃后直接丢弃
+        if not self.closed:
+            self.frames.put_nowait(item)
+
+class _MCPWorker:
+    """进程池中的一个 MCP 服务子进程：请求按 id 多路复用，记录在途请求数与忙碌时间"""
+    def __init__(self, index, script_path, env=None):
+        self.index = index
+        self.script_path = script_path
+        self.env = env
+        self.process = None
+        self.outstanding = 0
+        self.stats = {"calls": 0, "errors": 0, "restarts": -1, "busy_seconds": 0.0}
+        self.started_at = None
+        self._busy_since = None
+        self._pending = {}
+        self._streams = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def spawn(self):
+        # 旧进程上未完成的请求不会再有响应
+        self._fail_pending(ConnectionError(f"MCP 服务进程 #{self.index} 已退出"))
+        process = subprocess.Popen(
+            [sys.executable, self.script_path],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=sys.stderr,
             text=True,
-            bufsize=1
+            bufsize=1,
+            env=self.env
         )
-        self.tools_map = {}
-        self._initialize()
+        with self._pending_lock:
+            self.process = process
+        self.stats["restarts"] += 1
+        # 利用率按当前进程的存活时间计算
+        self.stats["busy_seconds"] = 0.0
+        self._busy_since = time.perf_counter() if self.outstanding else None
+        self.started_at = time.perf_counter()
+        threading.Thread(target=self._read_loop, args=(process,), name=f"mcp-reader-{self.index}",
+                         daemon=True).start()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _read_loop(self, process):
+        for line in process.stdout:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get("method") == "notifications/tools/chunk":
+                params = message.get("params", {})
+                with self._pending_lock:
+                    stream = self._streams.get(params.get("requestId"))
+                if stream is not None:
+                    stream.push(params)
+                continue
+            with self._pending_lock:
+                future = self._pending.pop(message.get("id"), None)
+                stream = self._streams.pop(message.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(message)
+            if stream is not None:
+                stream.push(_STREAM_END)
+        # stdout 关闭说明子进程已退出，唤醒所有等待者 (进程已被替换时，等待者属于新进程，不动)
+        self._fail_pending(ConnectionError(f"MCP 服务进程 #{self.index} 已退出"), process)
+
+    def _fail_pending(self, error, process=None):
+        with self._pending_lock:
+            if process is not None and process is not self.process:
+                return
+            pending = list(self._pending.values())
+            streams = list(self._streams.values())
+            self._pending.clear()
+            self._streams.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+        for stream in streams:
+            stream.push(_STREAM_END)
 
-    def _send_rpc(self, method, params=None):
-        request = {"jsonrpc": "2.0", "id": 1, "method": method}
+    def submit(self, msg_id, method, params=None, stream=None):
+        future = Future()
+        with self._pending_lock:
+            self._pending[msg_id] = future
+            if stream is not None:
+                self._streams[msg_id] = stream
+            if self.outstanding == 0:
+                self._busy_since = time.perf_counter()
+            self.outstanding += 1
+            self.stats["calls"] += 1
+        future.add_done_callback(self._done)
+
+        request = {"jsonrpc": "2.0", "id": msg_id, "method": method}
         if params: request["params"] = params
-        self.process.stdin.write(json.dumps(request) + "\n")
-        self.process.stdin.flush()
-        return json.loads(self.process.stdout.readline())
-
-    def _initialize(self):
-        self._send_rpc("initialize")
-        response = self._send_rpc("tools/list")
-        for tool in response.get("result", {}).get("tools", []):
-            self.tools_map[tool['name']] = tool
-
-    def call_tool(self, name, args):
-        response = self._send_rpc("tools/call", {"name": name, "arguments": args})
+        try:
+            with self._write_lock:
+                self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            self.forget(msg_id, ConnectionError(f"MCP 请求发送失败: {e}"))
+            if stream is not None:
+                stream.push(_STREAM_END)
+        return future
+
+    def notify(self, method, params):
+        """发送不需要响应的通知 (流式调用的 ack / 取消)；进程已退出时忽略"""
+        try:
+            with self._write_lock:
+                self.process.stdin.write(json.dumps({"jsonrpc": "2.0", "method": method, "params": params}) + "\n")
+                self.process.stdin.flush()
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def _done(self, future):
+        with self._pending_lock:
+            if not future.cancelled() and future.exception() is not None:
+                self.stats["errors"] += 1
+            self.outstanding -= 1
+            if self.outstanding == 0 and self._busy_since is not None:
+                self.stats["busy_seconds"] += time.perf_counter() - self._busy_since
+                self._busy_since = None
+
+    def forget(self, msg_id, error=None):
+        """放弃等待某个请求 (超时 / 消费者退出 / 发送失败)；在途计数随之归还"""
+        with self._pending_lock:
+            future = self._pending.pop(msg_id, None)
+            self._streams.pop(msg_id, None)
+        if future is not None and not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.cancel()
+
+    def metrics(self):
+        with self._pending_lock:
+            busy = self.stats["busy_seconds"]
+            if self._busy_since is not None:
+                busy += time.perf_counter() - self._busy_since
+            uptime = time.perf_counter() - self.started_at if self.started_at else 0.0
+            return dict(self.stats, index=self.index, pid=self.process.pid if self.process else None, alive=self.alive(),
+                        outstanding=self.outstanding, busy_seconds=busy,
+                        utilization=busy / uptime if uptime > 0 else 0.0)
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+
+class MCPClient:
+    def __init__(self, script_path, timeout=120, stream_buffer_frames=64, lazy=False, workers=1, health_interval=5,
+                 extract_cache=None):
+        self.script_path = script_path
+        self.timeout = timeout
+        self.stream_buffer_frames = stream_buffer_frames
+        self.health_interval = health_interval
+        self.tools_map = {}
+        self.startup_seconds = None
+
+        # 服务进程池：每个进程内部仍按请求 id 多路复用，调用派发给在途请求最少的进程
+        env = dict(os.environ)
+        if workers > 1 and "MCP_EXTRACT_WORKERS" not in os.environ:
+            # 各进程平分 CPU，避免每个进程都按核数创建解析进程池
+            env["MCP_EXTRACT_WORKERS"] = str(max(1, (os.cpu_count() or 1) // workers))
+        # 提取缓存 (agents.yaml 中 mcp.extract_cache)：所有服务进程共用同一个 SQLite 文件
+        if extract_cache is not None:
+            if not extract_cache.get("enabled", True):
+                env["MCP_EXTRACT_CACHE"] = ""
+            else:
+                if extract_cache.get("path"):
+                    env["MCP_EXTRACT_CACHE"] = extract_cache["path"]
+                if extract_cache.get("max_mb"):
+                    env["MCP_EXTRACT_CACHE_BYTES"] = str(int(extract_cache["max_mb"] * 1024 * 1024))
+        self.workers = [_MCPWorker(i, script_path, env) for i in range(max(1, workers))]
+        self._ids = itertools.count(1)
+        self._start_lock = threading.RLock()
+        self._ready = False
+        self._closed = False
+
+        if not lazy:
+            self.start()
+
+    def start(self, background=False):
+        """启动全部 MCP 服务子进程并完成握手 (重复调用无副作用)"""
+        if background:
+            thread = threading.Thread(target=self._start_quietly, name="mcp-start", daemon=True)
+            thread.start()
+            return thread
+        if self._ready:
+            return
+        with self._start_lock:
+            if self._ready:
+                return
+            start = time.perf_counter()
+            # 先全部拉起再逐个握手，多个进程的启动时间相互重叠
+            for worker in self.workers:
+                worker.spawn()
+            try:
+                for worker in self.workers:
+                    self._handshake(worker, list_tools=worker is self.workers[0])
+            except Exception:
+                for worker in self.workers:
+                    worker.close()
+                    worker.process = None
+                raise
+            self._ready = True
+            self.startup_seconds = time.perf_counter() - start
+            if self.health_interval:
+                threading.Thread(target=self._health_loop, name="mcp-health", daemon=True).start()
+
+    def _start_quietly(self):
+        try:
+            self.start()
+        except Exception as e:
+            print(f"  ⚠️ MCP 服务启动失败: {e}")
+
+    def _handshake(self, worker, list_tools=False):
+        """initialize 握手；tools/list 只在首个进程上请求一次，结果由整个池共享"""
+        worker.submit(next(self._ids), "initialize").result(timeout=self.timeout)
+        if list_tools:
+            response = worker.submit(next(self._ids), "tools/list").result(timeout=self.timeout)
+            for tool in response.get("result", {}).get("tools", []):
+                self.tools_map[tool['name']] = tool
+
+    def _respawn(self, worker):
+        with self._start_lock:
+            if worker.alive() or self._closed:
+                return
+            print(f"  ♻️ MCP 服务进程 #{worker.index} 已退出 (code {worker.process.returncode})，正在重启...")
+            worker.spawn()
+            try:
+                self._handshake(worker)
+            except Exception as e:
+                print(f"  ⚠️ MCP 服务进程 #{worker.index} 重启失败: {e}")
+
+    def _health_loop(self):
+        while not self._closed:
+            time.sleep(self.health_interval)
+            for worker in self.workers:
+                if not self._closed and not worker.alive():
+                    self._respawn(worker)
+
+    def _pick(self):
+        """选择在途请求最少的存活进程；全部退出时就地重启一个"""
+        alive = [w for w in self.workers if w.alive()]
+        if not alive:
+            self._respawn(self.workers[0])
+            return self.workers[0]
+        return min(alive, key=lambda w: w.outstanding)
+
+    def _submit(self, method, params=None, stream=None):
+        self.start()
+        worker = self._pick()
+        msg_id = next(self._ids)
+        return worker, msg_id, worker.submit(msg_id, method, params, stream)
+
+    def _send_rpc(self, method, params=None, timeout=None):
+        # 进程在处理中途退出时换一个进程重试一次 (文档读取是幂等的)
+        for attempt in range(2):
+            worker, msg_id, future = self._submit(method, params)
+            try:
+                return future.result(timeout=timeout or self.timeout)
+            except TimeoutError:
+                worker.forget(msg_id)
+                raise
+            except ConnectionError:
+                if attempt:
+                    raise
+
+    async def _asend_rpc(self, method, params=None, timeout=None):
+        for attempt in range(2):
+            worker, msg_id, future = self._submit(method, params)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+            except asyncio.TimeoutError:
+                worker.forget(msg_id)
+                raise
+            except ConnectionError:
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _tool_text(response):
         if "result" in response and "content" in response["result"]:
             return response["result"]["content"][0]["text"]
+        if "error" in response:
+            return f"Tool execution failed: {response['error'].get('message', '')}"
         return "Tool execution failed"
 
+    def call_tool(self, name, args, timeout=None):
+        with tracing.span("mcp.call_tool", tool=name, request_bytes=len(json.dumps(args))) as span:
+            try:
+                response = self._send_rpc("tools/call", {"name": name, "arguments": args}, timeout)
+            except TimeoutError:
+                span.set(timeout=True)
+                return f"Tool execution timed out ({timeout or self.timeout}s)"
+            text = self._tool_text(response)
+            span.set(response_chars=len(text))
+            return text
+
+    async def acall_tool(self, name, args, timeout=None):
+        with tracing.span("mcp.call_tool", tool=name, request_bytes=len(json.dumps(args))) as span:
+            try:
+                response = await self._asend_rpc("tools/call", {"name": name, "arguments": args}, timeout)
+            except asyncio.TimeoutError:
+                span.set(timeout=True)
+                return f"Tool execution timed out ({timeout or self.timeout}s)"
+            text = self._tool_text(response)
+            span.set(response_chars=len(text))
+            return text
+
+    def call_tool_stream(self, name, args, timeout=None):
+        """流式调用工具：逐帧产出 {"source", "text"}，内存占用与帧缓冲大小成正比
+
+        timeout 是相邻两帧之间允许的最长间隔。生成器结束后可从
+        返回值 (StopIteration.value) 取得最终摘要。
+        """
+        stream = _ToolStream(self.stream_buffer_frames)
+        span = tracing.span("mcp.call_tool_stream", tool=name, request_bytes=len(json.dumps(args))).begin()
+        frames = chars = unacked = 0
+        ack_every = max(1, stream.window // 2)
+        error = "GeneratorExit"  # 未走到结尾即被关闭
+        worker, msg_id, future = self._submit(
+            "tools/call", {"name": name, "arguments": args, "stream": True, "window": stream.window}, stream)
+        try:
+            while True:
+                try:
+                    item = stream.frames.get(timeout=timeout or self.timeout)
+                except queue.Empty:
+                    error = "TimeoutError"
+                    raise TimeoutError(f"Tool stream timed out ({timeout or self.timeout}s)")
+                if item is _STREAM_END:
+                    break
+                text = item.get("text", "")
+                frames += 1
+                chars += len(text)
+                # 帧已离开缓冲区，归还额度让服务端继续发送
+                unacked += 1
+                if unacked >= ack_every:
+                    worker.notify("notifications/tools/ack", {"requestId": msg_id, "frames": unacked})
+                    unacked = 0
+                yield {"source": item.get("source"), "text": text}
+            result = self._tool_text(future.result(timeout=timeout or self.timeout))
+            error = None
+            return result
+        finally:
+            stream.closed = True
+            if error is not None:
+                # 消费者提前退出或超时：让服务端停止读取与发送
+                worker.notify("notifications/tools/ack", {"requestId": msg_id, "cancel": True})
+            worker.forget(msg_id)
+            span.set(frames=frames, chars=chars)
+            span.end(error)
+
     def get_ollama_tools(self):
+        self.start()
         return [{
             "type": "function",
             "function": {
@@ -44,5 +391,44 @@ class MCPClient:
             }
         } for name, tool in self.tools_map.items()]
 
+    def extract_cache_stats(self):
+        """各服务进程提取缓存 (cache/stats) 的汇总：命中计数按进程相加，磁盘占用取共享文件的值"""
+        if not self._ready:
+            return None
+        totals = None
+        for worker in self.workers:
+            if not worker.alive():
+                continue
+            try:
+                result = worker.submit(next(self._ids), "cache/stats").result(timeout=self.timeout).get("result", {})
+            except (ConnectionError, TimeoutError):
+                continue
+            stats = result.get("stats")
+            if not stats:
+                continue
+            if totals is None:
+                totals = dict(stats)
+                continue
+            for key in ("hits", "misses", "stores", "evictions", "chars_served", "seconds_saved"):
+                totals[key] += stats[key]
+            totals["entries"] = max(totals["entries"], stats["entries"])
+            totals["disk_bytes"] = max(totals["disk_bytes"], stats["disk_bytes"])
+        if totals:
+            lookups = totals["hits"] + totals["misses"]
+            totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+        return totals
+
+    def metrics(self):
+        """进程池状态：每个进程的在途请求数 (队列深度)、调用数、重启次数与利用率"""
+        workers = [worker.metrics() for worker in self.workers] if self._ready else []
+        return {
+            "workers": workers,
+            "alive": sum(1 for w in workers if w["alive"]),
+            "outstanding": sum(w["outstanding"] for w in workers),
+            "restarts": sum(w["restarts"] for w in workers)
+        }
+
     def close(self):
-        self.process.terminate()
+        self._closed = True
+        for worker in self.workers:
+            worker.close()
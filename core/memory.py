@@ -1,72 +1,487 @@
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-import uuid
 import os
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from core.vector_store import ChromaStore, NumpyStore, list_numpy_collections
+from core import tracing
+from core.embedding import EmbeddingEngine, load_model
+
+def split_text(text, chunk_size=500):
+    """按固定长度切片"""
+    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+
+class EmbeddingCache:
+    """两级嵌入缓存：进程内 LRU + 磁盘 SQLite，按 hash(模型名, 文本) 寻址"""
+    def __init__(self, model_name, db_path, max_items=2048, max_disk_bytes=256 * 1024 * 1024):
+        self.model_name = model_name
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vec BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()
+        self._disk_bytes = row[0]
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts):
+        """返回与 texts 对齐的向量列表，未命中的位置为 None"""
+        keys = [self._key(t) for t in texts]
+        results = [None] * len(texts)
+        disk_lookup = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vec
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup:
+                found = {}
+                pending = list(disk_lookup)
+                for j in range(0, len(pending), 500):
+                    part = pending[j:j+500]
+                    rows = self._conn.execute(
+                        f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                    ).fetchall()
+                    for key, blob in rows:
+                        vec = array("f")
+                        vec.frombytes(blob)
+                        found[key] = vec.tolist()
+                if found:
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in found]
+                    )
+                    self._conn.commit()
+                for key, positions in disk_lookup.items():
+                    vec = found.get(key)
+                    if vec is None:
+                        self.misses += len(positions)
+                        continue
+                    self.disk_hits += len(positions)
+                    self._remember(key, vec)
+                    for i in positions:
+                        results[i] = vec
+        return results
+
+    def put_many(self, texts, vectors):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                key = self._key(text)
+                self._remember(key, vec)
+                rows.append((key, array("f", vec).tobytes(), now))
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            self._disk_bytes += sum(len(r[1]) for r in rows)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    def _evict_disk(self):
+        # INSERT OR REPLACE 覆盖已有条目时累加值会偏大，先按实际大小重新计算，再按最近访问时间淘汰到上限的 90%
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0]
+        target = int(self.max_disk_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(vec) FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            victims = []
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                victims.append((key,))
+                self._disk_bytes -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.commit()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_items": len(self._lru),
+            "disk_bytes": self._disk_bytes
+        }
+
+def memory_options(config):
+    """agents.yaml 的 memory 段 + 各智能体的 memory_backend -> MemorySystem 的构造参数"""
+    options = dict(config.get("memory", {}))
+    options["collection_backends"] = dict(options.get("collection_backends") or {})
+    for agent_cfg in config.get("agents", []):
+        if agent_cfg.get("memory_backend"):
+            options["collection_backends"][agent_cfg["collection_name"]] = agent_cfg["memory_backend"]
+    return options
 
 class MemorySystem:
-    def __init__(self, persist_path="./chroma_db"):
-        print("正在初始化记忆系统 (ChromaDB + SentenceTransformer)...")
-        # 1. 初始化向量数据库 (持久化存储)
+    def __init__(self, persist_path="./chroma_db", model_name="all-MiniLM-L6-v2",
+                 cache_items=2048, cache_disk_mb=256, lazy=False,
+                 backend="chroma", collection_backends=None, vector_store_path="./vector_store",
+                 quantization=None, rerank_factor=4, embedding=None):
+        self.persist_path = persist_path
+        self.model_name = model_name
+        # 存储后端：默认后端 + 按集合覆盖 ("chroma" 或 "numpy")
+        self.backend = backend
+        self.collection_backends = dict(collection_backends or {})
+        self.vector_store_path = vector_store_path
+        # numpy 后端的量化存储 ("float16" / "int8")，检索时用 float32 对候选精确重排
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        # 嵌入后端与微批设置 (backend: torch | onnx；batch_window_ms / max_batch 见 EmbeddingEngine)
+        embedding = dict(embedding or {})
+        self.embedding_backend = embedding.pop("backend", "torch")
+        self.onnx_file = embedding.pop("onnx_file", None)
+        self.engine = EmbeddingEngine(lambda texts, batch_size: self.embedding_model.encode(texts, batch_size=batch_size),
+                                      **embedding)
+        self._stores = {}
+        # 每个集合的写入版本号，供语义响应缓存判断回答是否过期
+        self._versions = {}
+        self._stores_lock = threading.Lock()
+        # chromadb / sentence_transformers 的导入与加载都推迟到首次使用 (lazy=True 时)
+        self._client = None
+        self._embedding_model = None
+        self._client_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.startup_timings = {}
+
+        # 嵌入缓存 (与 chroma_db/ 同级的 SQLite 文件)
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(persist_path)), "embedding_cache.sqlite3")
+        self.embedding_cache = EmbeddingCache(self._cache_model_key(self.embedding_backend), cache_path,
+                                              max_items=cache_items,
+                                              max_disk_bytes=cache_disk_mb * 1024 * 1024)
+        self.last_ingest_stats = {}
+
+        if not lazy:
+            print("正在初始化记忆系统 (ChromaDB + SentenceTransformer)...")
+            self.client
+            self.embedding_model
+            print("✅ 记忆系统准备就绪")
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    start = time.perf_counter()
+                    import sentence_transformers
+                    self.startup_timings["sentence_transformers_import"] = time.perf_counter() - start
+                    start = time.perf_counter()
+                    kwargs = {"onnx_file": self.onnx_file} if self.onnx_file else {}
+                    model, backend = load_model(self.model_name, self.embedding_backend, **kwargs)
+                    self.startup_timings["embedding_model_load"] = time.perf_counter() - start
+                    if backend != self.embedding_backend:
+                        # 回退后的向量与量化模型不同，缓存不能混用
+                        self.embedding_backend = backend
+                        self.embedding_cache.model_name = self._cache_model_key(backend)
+                    self._embedding_model = model
+        return self._embedding_model
+
+    def _cache_model_key(self, backend):
+        return self.model_name if backend == "torch" else f"{self.model_name}@{backend}"
+
+    def _create_client(self):
+        start = time.perf_counter()
+        import chromadb
+        from chromadb.config import Settings
+        self.startup_timings["chromadb_import"] = time.perf_counter() - start
+
+        # 初始化向量数据库 (持久化存储)
+        start = time.perf_counter()
         try:
             if hasattr(chromadb, 'PersistentClient'):
-                self.client = chromadb.PersistentClient(path=persist_path)
+                client = chromadb.PersistentClient(path=self.persist_path)
             else:
-                self.client = chromadb.Client(Settings(
+                client = chromadb.Client(Settings(
                     chroma_db_impl="duckdb+parquet",
-                    persist_directory=persist_path
+                    persist_directory=self.persist_path
                 ))
         except Exception as e:
             print(f"ChromaDB 初始化警告: {e}")
-            self.client = chromadb.Client(Settings(
+            client = chromadb.Client(Settings(
                 chroma_db_impl="duckdb+parquet",
-                persist_directory=persist_path
+                persist_directory=self.persist_path
             ))
-        
-        # 2. 初始化嵌入模型
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        print("✅ 记忆系统准备就绪")
+        self.startup_timings["chroma_client"] = time.perf_counter() - start
+        return client
+
+    def warmup(self, background=True):
+        """预加载向量库客户端与嵌入模型；background=True 时两者在后台线程中并行加载"""
+        def load(attr):
+            try:
+                getattr(self, attr)
+            except Exception as e:
+                print(f"  ⚠️ 记忆系统预热失败 ({attr}): {e}")
+
+        attrs = ["embedding_model"]
+        if self.backend == "chroma" or "chroma" in self.collection_backends.values():
+            attrs.append("client")
+        threads = [threading.Thread(target=load, args=(attr,), daemon=True) for attr in attrs]
+        for thread in threads:
+            thread.start()
+        if not background:
+            for thread in threads:
+                thread.join()
+        return threads
 
     def get_collection(self, name):
-        """获取或创建指定名称的集合"""
-        return self.client.get_or_create_collection(name=name)
+        """获取或创建指定名称的集合 (返回 VectorStore，按配置选择后端)"""
+        store = self._stores.get(name)
+        if store is None:
+            with self._stores_lock:
+                store = self._stores.get(name)
+                if store is None:
+                    backend = self.collection_backends.get(name, self.backend)
+                    if backend == "numpy":
+                        store = NumpyStore(os.path.join(self.vector_store_path, name),
+                                           quantization=self.quantization, rerank_factor=self.rerank_factor)
+                    elif backend == "chroma":
+                        store = ChromaStore(self.client, name)
+                    else:
+                        raise ValueError(f"未知的向量存储后端: {backend}")
+                    self._stores[name] = store
+        return store
+
+    def embed(self, texts):
+        """编码文本；命中缓存的文本跳过模型前向计算，其余交给微批引擎与并发请求合批编码"""
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        with tracing.span("memory.embed", texts=len(texts), chars=sum(len(t) for t in texts)) as span:
+            vectors = self.embedding_cache.get_many(texts)
+            missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+            span.set(cache_misses=len(missing))
+            if missing:
+                encoded = self.engine.encode(missing)
+                self.embedding_cache.put_many(missing, encoded)
+                lookup = dict(zip(missing, encoded))
+                vectors = [v if v is not None else lookup[t] for t, v in zip(texts, vectors)]
+        return vectors[0] if single else vectors
 
     def add_memory(self, text, metadata=None, collection_name="long_term_memory"):
         """添加一条长期记忆到指定集合"""
-        target_collection = self.get_collection(collection_name)
-        embedding = self.embedding_model.encode(text).tolist()
-        
-        target_collection.add(
-            documents=[text],
-            embeddings=[embedding],
-            metadatas=[metadata or {"source": "user_chat"}],
-            ids=[str(uuid.uuid4())]
-        )
-        if hasattr(self.client, 'persist'):
-            self.client.persist()
+        self.add_memories([text], [metadata] if metadata else None, collection_name=collection_name)
         return True
 
-    def query_memory(self, query_text, n_results=3, collection_name="long_term_memory"):
-        """从指定集合中检索相关记忆"""
+    @staticmethod
+    def chunk_id(collection_name, text):
+        """内容寻址的切片 id：同一集合中相同内容总是得到相同 id"""
+        return hashlib.sha256(f"{collection_name}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+    def add_memories(self, texts, metadatas=None, collection_name="long_term_memory", batch_size=64):
+        """批量添加记忆：按批编码、按批写入，每批只持久化一次
+
+        切片 id 由内容哈希得出，已存在的切片直接跳过 (不重新编码)，写入使用 upsert 语义。
+        """
+        if not texts:
+            return 0
+        if metadatas is None:
+            metadatas = [{"source": "user_chat"}] * len(texts)
+        elif isinstance(metadatas, dict):
+            metadatas = [metadatas] * len(texts)
+
+        start = time.perf_counter()
+        with tracing.span("memory.ingest", collection=collection_name, chunks=len(texts)) as span:
+            written = self._upsert_chunks(list(zip(texts, metadatas)), collection_name, batch_size)
+            span.set(written=written)
+        self._report_ingest(collection_name, len(texts), written, time.perf_counter() - start)
+        return written
+
+    def add_memories_stream(self, frames, collection_name="long_term_memory", metadata=None,
+                            chunk_size=500, batch_size=64):
+        """从帧迭代器 (如 MCPClient.call_tool_stream) 边读边切片入库，内存只保留一个批次"""
+        start = time.perf_counter()
+        pending = []
+        total = written = frame_count = 0
+        with tracing.span("memory.ingest", collection=collection_name, stream=True) as span:
+            for frame in frames:
+                frame_count += 1
+                if isinstance(frame, str):
+                    frame = {"text": frame}
+                frame_metadata = dict(metadata or {"source": "user_chat"})
+                if frame.get("source"):
+                    frame_metadata["source"] = frame["source"]
+                for chunk in split_text(frame.get("text", ""), chunk_size):
+                    pending.append((chunk, frame_metadata))
+                while len(pending) >= batch_size:
+                    batch, pending = pending[:batch_size], pending[batch_size:]
+                    written += self._upsert_chunks(batch, collection_name, batch_size)
+                    total += len(batch)
+            if pending:
+                written += self._upsert_chunks(pending, collection_name, batch_size)
+                total += len(pending)
+            span.set(frames=frame_count, chunks=total, written=written)
+        self._report_ingest(collection_name, total, written, time.perf_counter() - start)
+        self.last_ingest_stats["frames"] = frame_count
+        return self.last_ingest_stats
+
+    def _upsert_chunks(self, items, collection_name, batch_size):
+        """写入 (text, metadata) 列表，返回实际新写入的切片数"""
+        # 同一批次内重复的切片只保留第一份
+        unique = {}
+        for text, metadata in items:
+            unique.setdefault(self.chunk_id(collection_name, text), (text, metadata))
+        items = list(unique.items())
+
         target_collection = self.get_collection(collection_name)
-        
-        count = target_collection.count()
-        if count == 0:
-            return []
-        
-        effective_n_results = min(n_results, count)
-        query_embedding = self.embedding_model.encode(query_text).tolist()
-        
-        results = target_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=effective_n_results
-        )
-        
-        memories = []
-        if results["documents"]:
-            for doc in results["documents"][0]:
-                memories.append(doc)
-        return memories
+        written = 0
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i+batch_size]
+            existing = target_collection.existing_ids([chunk_id for chunk_id, _ in batch])
+            batch = [item for item in batch if item[0] not in existing]
+            if not batch:
+                continue
+            documents = [text for _, (text, _) in batch]
+            target_collection.upsert(
+                ids=[chunk_id for chunk_id, _ in batch],
+                embeddings=self.embed(documents),
+                documents=documents,
+                metadatas=[metadata for _, (_, metadata) in batch]
+            )
+            written += len(batch)
+            target_collection.persist()
+        if written:
+            self._bump_version(collection_name)
+        return written
+
+    def _bump_version(self, collection_name):
+        with self._stores_lock:
+            self._versions[collection_name] = self._versions.get(collection_name, 0) + 1
+
+    def collection_version(self, collection_name):
+        """集合内容的版本号，每次实际写入或删除后递增"""
+        return self._versions.get(collection_name, 0)
+
+    def _report_ingest(self, collection_name, total, written, elapsed):
+        rate = total / elapsed if elapsed > 0 else float("inf")
+        self.last_ingest_stats = {
+            "collection": collection_name,
+            "chunks": total,
+            "written": written,
+            "skipped": total - written,
+            "seconds": elapsed,
+            "chunks_per_sec": rate
+        }
+        if total > 1:
+            print(f"  📥 [记忆] {collection_name}: 新写入 {written} / {total} 个切片，跳过重复 {total - written} "
+                  f"({elapsed:.2f}s, {rate:.1f} chunks/s)")
+
+    def compact_collection(self, collection_name, page_size=1000):
+        """对已有集合去重：按内容哈希重建 id，删除重复副本 (复用已有向量，不重新编码)"""
+        target_collection = self.get_collection(collection_name)
+        before = target_collection.count()
+
+        # 1. 扫描全部 id 与文档内容
+        records = []
+        for offset in range(0, before, page_size):
+            page = target_collection.get(limit=page_size, offset=offset)
+            records.extend(zip(page["ids"], page["documents"]))
+
+        # 2. 每个内容保留一份：已是内容 id 的直接保留，否则选第一份迁移到内容 id
+        present = {record_id for record_id, _ in records}
+        rekey = {}
+        stale = []
+        for record_id, document in records:
+            canonical = self.chunk_id(collection_name, document)
+            if record_id == canonical:
+                continue
+            stale.append(record_id)
+            if canonical not in present and canonical not in rekey:
+                rekey[canonical] = record_id
+
+        # 3. 迁移 (复制向量与元数据到新 id)，再删除旧 id
+        pairs = list(rekey.items())
+        for i in range(0, len(pairs), page_size):
+            part = pairs[i:i+page_size]
+            old = target_collection.get(ids=[old_id for _, old_id in part], include_embeddings=True)
+            by_id = {old_id: idx for idx, old_id in enumerate(old["ids"])}
+            new_ids, documents, metadatas, embeddings = [], [], [], []
+            for canonical, old_id in part:
+                idx = by_id[old_id]
+                new_ids.append(canonical)
+                documents.append(old["documents"][idx])
+                metadatas.append(old["metadatas"][idx])
+                embeddings.append(old["embeddings"][idx])
+            target_collection.upsert(ids=new_ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        for i in range(0, len(stale), page_size):
+            target_collection.delete(stale[i:i+page_size])
+        target_collection.persist()
+        if pairs or stale:
+            self._bump_version(collection_name)
+
+        after = target_collection.count()
+        return {"collection": collection_name, "before": before, "after": after, "removed": before - after}
+
+    def backend_of(self, collection_name):
+        """集合按配置所在的后端 (get_collection 打开的就是这个后端)"""
+        return self.collection_backends.get(collection_name, self.backend)
+
+    def list_collections(self):
+        """磁盘上已有的集合：[(集合名, 所在后端)]；同名集合可能同时存在于两个后端"""
+        found = [(name, "numpy") for name in list_numpy_collections(self.vector_store_path)]
+        # 没有 chroma 数据目录时不初始化客户端 (否则会凭空创建一个空库)
+        if os.path.isdir(self.persist_path):
+            found += [(getattr(c, "name", c), "chroma") for c in self.client.list_collections()]
+        return sorted(found)
+
+    def search(self, query_text, n_results=3, collection_name="long_term_memory", where=None, max_distance=None):
+        """带分数的检索：返回 [{"id", "document", "metadata", "distance"}]，按距离升序
+
+        where 为 Chroma 风格的元数据过滤 (如 {"agent": "CourseTutor"})，
+        max_distance 过滤掉距离 (L2 平方) 超过阈值的结果。
+        """
+        with tracing.span("memory.query", collection=collection_name, n_results=n_results) as span:
+            target_collection = self.get_collection(collection_name)
+            if target_collection.count() == 0:
+                span.set(hits=0)
+                return []
+            hits = target_collection.query(self.embed(query_text), n_results, where=where)
+            if max_distance is not None:
+                hits = [hit for hit in hits if hit["distance"] is None or hit["distance"] <= max_distance]
+            span.set(hits=len(hits))
+        return hits
+
+    def query_memory(self, query_text, n_results=3, collection_name="long_term_memory", where=None, max_distance=None):
+        """从指定集合中检索相关记忆 (只返回文档内容)"""
+        hits = self.search(query_text, n_results, collection_name, where=where, max_distance=max_distance)
+        return [hit["document"] for hit in hits]
 
     def count(self, collection_name="long_term_memory"):
         return self.get_collection(collection_name).count()
@@ -0,0 +1,151 @@
+import threading
+import time
+
+import requests
+
+# === 模型预热与常驻管理 ===
+# Ollama 在模型空闲 keep_alive 时长后将其卸载，下一个请求要承担完整的加载延迟。
+# 启动时预加载配置中用到的模型，定时为近期使用过的模型续期 keep_alive，
+# 并通过 /api/ps 跟踪哪些模型常驻，请求落到未加载的模型上时计为一次冷启动
+
+DEFAULT_MODEL = "qwen2.5:7b"
+
+def configured_models(config):
+    """配置中用到的全部模型 (Manager + 各智能体)，保持出现顺序"""
+    default = config.get("models", {}).get("default", DEFAULT_MODEL)
+    names = [config.get("manager", {}).get("model") or default]
+    names.extend(agent_cfg.get("model") or default for agent_cfg in config.get("agents", []))
+    return list(dict.fromkeys(names))
+
+class ModelManager:
+    def __init__(self, llm_client, keep_alive="30m", pin_interval=240, hot_window=900, cold_threshold=0.5):
+        """keep_alive: 每个请求与续期请求附带的保活时长
+        pin_interval: 续期间隔 (秒)，0 表示不做定时续期
+        hot_window: 最近该时长 (秒) 内被使用过的模型算作热模型，定时续期
+        cold_threshold: 响应中 load_duration 超过该值 (秒) 视为发生了模型加载
+        """
+        self.llm = llm_client
+        self.keep_alive = keep_alive
+        self.pin_interval = pin_interval
+        self.hot_window = hot_window
+        self.cold_threshold = cold_threshold
+        self.resident = None  # 模型名 -> 过期时间 (来自 /api/ps)；None 表示无法查询
+        self.models = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        llm_client.keep_alive = keep_alive
+        llm_client.models = self
+
+    def _entry(self, model):
+        entry = self.models.get(model)
+        if entry is None:
+            entry = self.models[model] = {"requests": 0, "cold_starts": 0, "cold_routes": 0, "load_seconds": 0.0,
+                                          "warmups": 0, "last_used": None}
+        return entry
+
+    def on_request(self, model):
+        """请求发出前调用：目标模型当前不在常驻列表中时计一次冷路由"""
+        if not model:
+            return
+        with self._lock:
+            entry = self._entry(model)
+            entry["requests"] += 1
+            entry["last_used"] = time.time()
+            if self.resident is not None and model not in self.resident:
+                entry["cold_routes"] += 1
+                print(f"  🥶 [模型] {model} 当前未加载，本次请求需等待模型加载")
+                # 请求本身会把模型加载进来
+                self.resident[model] = None
+
+    def on_response(self, model, data):
+        """请求完成后调用：按 Ollama 返回的 load_duration 判断是否真的发生了加载"""
+        if not model:
+            return
+        load_seconds = (data.get("load_duration") or 0) / 1e9
+        with self._lock:
+            entry = self._entry(model)
+            if load_seconds >= self.cold_threshold:
+                entry["cold_starts"] += 1
+                entry["load_seconds"] += load_seconds
+            if self.resident is not None:
+                self.resident.setdefault(model, None)
+
+    def refresh(self):
+        """从 /api/ps 读取当前已加载的模型"""
+        try:
+            response = self.llm.session.get(f"{self.llm.base_url}/api/ps", timeout=self.llm.timeout)
+            response.raise_for_status()
+            loaded = {m.get("name") or m.get("model"): m.get("expires_at") for m in response.json().get("models", [])}
+        except (requests.RequestException, ValueError):
+            return None
+        with self._lock:
+            self.resident = loaded
+        return loaded
+
+    def warm(self, model):
+        """加载 (或续期) 模型：不带 prompt 的 /api/generate 只加载模型不生成，返回耗时"""
+        started = time.perf_counter()
+        try:
+            data = self.llm._post("/api/generate", {"model": model, "keep_alive": self.keep_alive}).json()
+        except requests.RequestException as e:
+            print(f"  ⚠️ [模型] {model} 预热失败: {e}")
+            return None
+        elapsed = time.perf_counter() - started
+        load_seconds = (data.get("load_duration") or 0) / 1e9
+        with self._lock:
+            entry = self._entry(model)
+            entry["warmups"] += 1
+            if load_seconds >= self.cold_threshold:
+                entry["load_seconds"] += load_seconds
+            if self.resident is not None:
+                self.resident.setdefault(model, None)
+        return elapsed
+
+    def preload(self, models, background=True):
+        """预加载模型 (启动时 / 配置重载后)；后台模式下不阻塞启动"""
+        if background:
+            thread = threading.Thread(target=self.preload, args=(models, False), name="model-preload", daemon=True)
+            thread.start()
+            return thread
+        self.refresh()
+        for model in models:
+            if self.resident is not None and model in self.resident:
+                continue
+            elapsed = self.warm(model)
+            if elapsed is not None:
+                print(f"  🔥 [模型] {model} 已预热 ({elapsed:.1f}s)")
+        self.refresh()
+
+    def hot_models(self):
+        cutoff = time.time() - self.hot_window
+        with self._lock:
+            return [name for name, entry in self.models.items()
+                    if entry["last_used"] is not None and entry["last_used"] >= cutoff]
+
+    def start(self):
+        """定时续期：刷新常驻列表，并为近期使用过的模型重新发送 keep_alive"""
+        if not self.pin_interval:
+            return
+        threading.Thread(target=self._pin_loop, name="model-keepalive", daemon=True).start()
+
+    def _pin_loop(self):
+        while not self._stop.wait(self.pin_interval):
+            self.refresh()
+            for model in self.hot_models():
+                self.warm(model)
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self):
+        with self._lock:
+            models = {name: dict(entry) for name, entry in self.models.items()}
+            resident = sorted(self.resident) if self.resident is not None else None
+        requests_total = sum(entry["requests"] for entry in models.values())
+        cold = sum(entry["cold_starts"] for entry in models.values())
+        return {
+            "resident": resident,
+            "models": models,
+            "cold_starts": cold,
+            "cold_start_rate": cold / requests_total if requests_total else 0.0
+        }
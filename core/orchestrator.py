@@ -1,11 +1,23 @@
-import requests
 import json
+import asyncio
+import time
+from core.llm import get_client, run_sync
+from core.context import ContextManager
+from core.cache import conversation_key
+from core import tracing
 
 class Orchestrator:
-    def __init__(self, agents, model="qwen2.5:7b"):
+    def __init__(self, agents, model="qwen2.5:7b", llm_client=None, stream=None, context=None, router=None):
         self.agents = agents
+        # 可选的嵌入路由：把握足够时直接派发，跳过 Manager 的 LLM 调用
+        self.router = router
+        self.routing_stats = {"requests": 0, "fast_path": 0, "llm": 0, "fast_seconds": 0.0, "llm_seconds": 0.0,
+                              "by_agent": {}}
         self.model = model
+        self.llm = llm_client or get_client()
+        self.stream = self.llm.stream if stream is None else stream
         self.history = []
+        self.context = ContextManager(llm_client=self.llm, model=model, **dict({"budget": 2048}, **(context or {})))
         self._build_system_prompt()
         self._build_tools()
 
@@ -13,8 +25,7 @@ class Orchestrator:
         agent_descriptions = "\n".join([f"{i+1}. {name}: {agent.description}" for i, (name, agent) in enumerate(self.agents.items())])
         agent_names = ", ".join(self.agents.keys())
         
-        self.history = [
-            {"role": "system", "content": f"""你是一个智能体团队的管理者 (Manager)。
+        self.system_prompt = f"""你是一个智能体团队的管理者 (Manager)。
 你的任务是根据用户的输入，判断应该将任务指派给哪位专家。
 
 团队成员如下：
@@ -22,8 +33,21 @@ class Orchestrator:
 
 请仔细分析用户意图，并调用工具 `dispatch_task` 将任务指派给最合适的专家。
 可选专家: {agent_names}
-"""}
-        ]
+"""
+        self.history = self.new_history()
+
+    def new_history(self):
+        """新会话的 Manager 初始 history"""
+        return [{"role": "system", "content": self.system_prompt}]
+
+    def adopt_state(self, previous):
+        """配置热重载：接管旧编排器的路由统计与 Manager history (系统提示换成新的团队介绍)"""
+        self.routing_stats = previous.routing_stats
+        self.history = previous.history
+        if self.history and self.history[0].get("role") == "system":
+            self.history[0] = {"role": "system", "content": self.system_prompt}
+        if self.router and previous.router:
+            self.router.warm_from(previous.router)
 
     def _build_tools(self):
         agent_names = list(self.agents.keys())
@@ -51,20 +75,119 @@ class Orchestrator:
         }]
 
     def process(self, user_input):
+        return run_sync(self.aprocess(user_input))
+
+    async def aprocess(self, user_input, session=None, raise_errors=False):
+        tokens = []
+        async for token in self.astream(user_input, session, raise_errors):
+            tokens.append(token)
+        return "".join(tokens)
+
+    def routing_metrics(self):
+        stats = self.routing_stats
+        return dict(
+            stats,
+            bypass_rate=stats["fast_path"] / stats["requests"] if stats["requests"] else 0.0,
+            fast_avg_ms=stats["fast_seconds"] / stats["fast_path"] * 1000 if stats["fast_path"] else 0.0,
+            llm_avg_ms=stats["llm_seconds"] / stats["llm"] * 1000 if stats["llm"] else 0.0
+        )
+
+    async def _fast_route(self, user_input):
+        if not self.router:
+            return None
+        with tracing.span("manager.route_fast") as span:
+            try:
+                name, score, margin = await asyncio.to_thread(self.router.route, user_input)
+            except Exception as e:
+                print(f"  ⚠️ 嵌入路由失败，改用 LLM 路由: {e}")
+                return None
+            span.set(agent=name, score=float(score), margin=float(margin))
+        if name not in self.agents:
+            print(f"  🧭 嵌入路由把握不足 (得分 {score:.2f}，领先 {margin:.2f})，交给 Manager 判断")
+            return None
+        print(f"  ⚡ 快速路由: 派发给 [{name}] (得分 {score:.2f}，领先 {margin:.2f})")
+        return name
+
+    def _agent_history(self, session, name):
+        return session.agent_history(name, self.agents[name]) if session else None
+
+    def _record_route(self, session, name):
+        by_agent = self.routing_stats["by_agent"]
+        by_agent[name] = by_agent.get(name, 0) + 1
+        if session:
+            session.last_agent = name
+        tracing.current_span().set(route=name)
+
+    async def astream(self, user_input, session=None, raise_errors=False):
+        """流式处理：派发后转发专家的 token，未派发时转发 Manager 自己的 token
+
+        session 提供该会话独立的 Manager / 专家 history (服务模式)；不传时使用共享的 history。
+        raise_errors=True 时异常直接抛给调用方 (批量 / 服务模式据此记为失败)，否则回复 "系统错误"。
+        """
+        with tracing.span("orchestrator.process", input_chars=len(user_input),
+                          session=session.session_id if session else None) as span:
+            output_chars = 0
+            async for token in self._astream(user_input, session, raise_errors):
+                output_chars += len(token)
+                yield token
+            span.set(output_chars=output_chars)
+
+    async def _astream(self, user_input, session, raise_errors=False):
+        history = session.manager_history(self) if session else self.history
         print(f"\n👔 [Manager] 正在分析意图...")
-        self.history.append({"role": "user", "content": user_input})
+        started_at = time.perf_counter()
+        self.routing_stats["requests"] += 1
+        # 语义缓存按整个会话此前的用户发言分区 (专家自己的 history 可能看不到其他专家处理过的轮次)
+        cache_context = conversation_key(history)
+        history.append({"role": "user", "content": user_input})
+
+        target = await self._fast_route(user_input)
+        if target:
+            self.routing_stats["fast_path"] += 1
+            self.routing_stats["fast_seconds"] += time.perf_counter() - started_at
+            self._record_route(session, target)
+            async for token in self.agents[target].astream(user_input, history=self._agent_history(session, target),
+                                                            raise_errors=raise_errors, cache_context=cache_context):
+                yield token
+            return
+        self.routing_stats["llm"] += 1
+        history[:], stats = await asyncio.to_thread(self.context.fit_with_stats, history)
         
         payload = {
             "model": self.model,
-            "messages": self.history,
+            "messages": history,
             "tools": self.tools_schema,
             "tool_choice": "auto", 
-            "stream": False
+            "stream": self.stream
         }
         
         try:
-            response = requests.post("http://localhost:11434/api/chat", json=payload)
-            message = response.json().get("message", {})
+            message = {}
+            final = {}
+            started = False
+            with tracing.span("manager.llm", model=self.model, prompt_tokens_est=stats.get("after", 0)) as span:
+                async for event in self.llm.chat_events(payload):
+                    if isinstance(event, str):
+                        if not started:
+                            print("  🤔 Manager 直接回复 (未派发):")
+                            print("Manager: ", end="", flush=True)
+                            started = True
+                        print(event, end="", flush=True)
+                        yield event
+                    else:
+                        final = event
+                        message = event.get("message", {})
+                span.set(prompt_eval_count=final.get("prompt_eval_count") or 0,
+                         eval_count=final.get("eval_count") or 0,
+                         dispatched=bool(message.get("tool_calls")))
+                if final.get("ttft") is not None:
+                    span.set(ttft_ms=final["ttft"] * 1000)
+            if started:
+                print()
+            self.routing_stats["llm_seconds"] += time.perf_counter() - started_at
+            actual = final.get("prompt_eval_count")
+            print(f"  📏 [Manager] 提示 tokens: 估算 {stats.get('after', 0)} (压缩前 {stats.get('before', 0)})"
+                  + (f"，实际 {actual}" if actual is not None else ""))
             
             if message.get("tool_calls"):
                 tool = message["tool_calls"][0]
@@ -77,15 +200,25 @@ class Orchestrator:
                     print(f"  👉 决策: 派发给 [{target_agent_name}] (任务: {task_desc})")
                     
                     if target_agent_name in self.agents:
-                        return self.agents[target_agent_name].chat(user_input, history_context=task_desc)
+                        self._record_route(session, target_agent_name)
+                        agent_history = self._agent_history(session, target_agent_name)
+                        async for token in self.agents[target_agent_name].astream(user_input, history_context=task_desc,
+                                                                                   history=agent_history,
+                                                                                   raise_errors=raise_errors,
+                                                                                   cache_context=cache_context):
+                            yield token
+                        return
                     else:
                         print(f"Error: Agent {target_agent_name} not found.")
             
-            print("  🤔 Manager 直接回复 (未派发):")
-            print(f"Manager: {message.get('content')}")
-            self.history.append(message)
-            return message.get("content")
+            self._record_route(session, "Manager")
+            if not started:
+                print("  🤔 Manager 直接回复 (未派发):")
+                print(f"Manager: {message.get('content')}")
+            history.append(message)
             
         except Exception as e:
             print(f"Manager Error: {e}")
-            return "系统错误"
+            if raise_errors:
+                raise
+            yield "系统错误"
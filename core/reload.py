@@ -0,0 +1,149 @@
+import hashlib
+import os
+import threading
+import time
+
+import yaml
+
+# === 配置热重载 ===
+# 监视 agents.yaml (mtime + 内容哈希)，按智能体定义做差异比较：只重建新增或变更的智能体，
+# 未变化的智能体 (history / 工具 schema / 检索设置) 原样保留。新的 Orchestrator 构建完成后
+# 一次性替换引用，正在处理的请求继续使用旧对象，之后的请求使用新对象
+
+# 这些配置段在启动时生效，变更后需重启
+RESTART_SECTIONS = ("runtime", "llm", "models", "memory", "mcp", "server")
+
+def diff_agents(old_config, new_config):
+    """比较两份配置中的智能体定义，返回 {"added", "changed", "removed", "unchanged"} (名字列表)"""
+    old = {cfg["name"]: cfg for cfg in old_config.get("agents", [])}
+    new = {cfg["name"]: cfg for cfg in new_config.get("agents", [])}
+    return {
+        "added": [name for name in new if name not in old],
+        "changed": [name for name in new if name in old and new[name] != old[name]],
+        "removed": [name for name in old if name not in new],
+        "unchanged": [name for name in new if name in old and new[name] == old[name]]
+    }
+
+class ConfigWatcher:
+    """按 mtime/大小 发现文件变化，再用内容哈希排除 touch 等无实际改动的情况"""
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+        self._digest = None
+        self.poll()
+
+    def _read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def poll(self):
+        """文件内容有变化时返回新内容 (bytes)，否则返回 None"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stat = (st.st_mtime_ns, st.st_size)
+        if stat == self._stat:
+            return None
+        self._stat = stat
+        data = self._read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest == self._digest:
+            return None
+        first = self._digest is None
+        self._digest = digest
+        return None if first else data
+
+class HotReloader:
+    """持有当前生效的智能体与编排器，配置变化时增量重建并原子替换
+
+    build_agent(agent_cfg) -> GenericAgent
+    build_orchestrator(config, agents) -> Orchestrator
+    """
+    def __init__(self, path, config, agents, orchestrator, build_agent, build_orchestrator, interval=2.0,
+                 on_config=None):
+        self.path = path
+        self.config = config
+        self.agents = agents
+        self.orchestrator = orchestrator
+        self.build_agent = build_agent
+        self.build_orchestrator = build_orchestrator
+        self.interval = interval
+        self.on_config = on_config  # 新配置生效后的回调 on_config(旧配置, 新配置)，如重新配置 tracing
+        self.listeners = []         # 编排器替换后的回调 (如服务模式下更新 AgentService.orchestrator)
+        self.watcher = ConfigWatcher(path)
+        self.stats = {"reloads": 0, "failures": 0, "last_seconds": 0.0, "total_seconds": 0.0,
+                      "agents_rebuilt": 0, "agents_kept": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """后台轮询配置文件"""
+        threading.Thread(target=self._watch_loop, name="config-watcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"  ⚠️ 配置监视出错: {e}")
+
+    def check(self):
+        data = self.watcher.poll()
+        if data is not None:
+            print(f"\n🔄 检测到 {self.path} 已修改，正在增量重载...")
+            return self.reload(data)
+        return None
+
+    def reload(self, data=None):
+        """重新加载配置 (data 为文件内容，不传时重新读取)；解析或构建失败时保留当前配置"""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                if data is None:
+                    with open(self.path, "rb") as f:
+                        data = f.read()
+                config = yaml.safe_load(data) or {}
+                diff = diff_agents(self.config, config)
+                agent_cfgs = {cfg["name"]: cfg for cfg in config.get("agents", [])}
+                # 先在旁边构建好全部新对象，任何一步失败都不影响当前生效的配置
+                agents = {}
+                for name, cfg in agent_cfgs.items():
+                    if name in diff["unchanged"]:
+                        agents[name] = self.agents[name]
+                    else:
+                        agents[name] = self.build_agent(cfg)
+                orchestrator = self.build_orchestrator(config, agents)
+                orchestrator.adopt_state(self.orchestrator)
+            except Exception as e:
+                self.stats["failures"] += 1
+                print(f"  ❌ 重载失败，继续使用当前配置: {e}")
+                return None
+
+            # 原子替换：之后的请求看到新的编排器
+            old_config = self.config
+            self.config, self.agents, self.orchestrator = config, agents, orchestrator
+            for listener in self.listeners:
+                listener(orchestrator)
+            if self.on_config:
+                self.on_config(old_config, config)
+
+            elapsed = time.perf_counter() - started
+            rebuilt = len(diff["added"]) + len(diff["changed"])
+            self.stats["reloads"] += 1
+            self.stats["last_seconds"] = elapsed
+            self.stats["total_seconds"] += elapsed
+            self.stats["agents_rebuilt"] += rebuilt
+            self.stats["agents_kept"] += len(diff["unchanged"])
+            print(f"  ✅ 配置已重载 ({elapsed * 1000:.0f} ms): 新增 {diff['added'] or '-'}，变更 {diff['changed'] or '-'}，"
+                  f"移除 {diff['removed'] or '-'}，保留 {len(diff['unchanged'])} 个")
+            stale = [section for section in RESTART_SECTIONS if old_config.get(section) != config.get(section)]
+            if stale:
+                print(f"  ⚠️ 以下配置段的修改需重启后生效: {', '.join(stale)}")
+            return dict(diff, seconds=elapsed)
+
+    def metrics(self):
+        return dict(self.stats)
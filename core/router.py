@@ -0,0 +1,89 @@
+import threading
+
+import numpy as np
+
+# === 嵌入路由 (快速路径) ===
+# 用智能体描述与示例语句的向量直接分类用户输入；只有区分度不够时才交给 Manager LLM
+
+class EmbeddingRouter:
+    def __init__(self, embed, routes, min_score=0.5, margin=0.1):
+        """embed: 文本列表 -> 向量列表 (通常是 MemorySystem.embed)
+        routes: {智能体名: [描述, 示例语句...]}
+        """
+        self.embed = embed
+        self.routes = {name: [u for u in utterances if u] for name, utterances in routes.items()}
+        self.min_score = min_score
+        self.margin = margin
+        self._names = None
+        self._labels = None
+        self._matrix = None
+        # 智能体名 -> (语句元组, 归一化向量)；配置热重载时未变化的路由直接复用
+        self._route_vectors = {}
+        self._lock = threading.Lock()
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def warm_from(self, other):
+        """从旧路由 (热重载前) 接收语句未变的路由向量，返回复用的路由数"""
+        if other is None:
+            return 0
+        with other._lock:
+            vectors = dict(other._route_vectors)
+        reused = 0
+        for name, (utterances, matrix) in vectors.items():
+            if tuple(self.routes.get(name, ())) == utterances:
+                self._route_vectors[name] = (utterances, matrix)
+                reused += 1
+        return reused
+
+    def _build(self):
+        """首次路由时把所有描述与示例编码一次 (已有向量的路由跳过)"""
+        with self._lock:
+            if self._matrix is not None:
+                return
+            names = list(self.routes)
+            missing = [name for name in names
+                       if name not in self._route_vectors or self._route_vectors[name][0] != tuple(self.routes[name])]
+            texts = [text for name in missing for text in self.routes[name]]
+            if texts:
+                encoded = self._normalize(self.embed(texts))
+                offset = 0
+                for name in missing:
+                    count = len(self.routes[name])
+                    self._route_vectors[name] = (tuple(self.routes[name]), encoded[offset:offset + count])
+                    offset += count
+            parts, labels = [], []
+            for index, name in enumerate(names):
+                utterances, matrix = self._route_vectors.get(name, ((), None))
+                if utterances:
+                    parts.append(matrix)
+                    labels.extend([index] * len(utterances))
+            self._matrix = np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+            self._labels = np.array(labels, dtype=np.int64)
+            self._names = names
+
+    def scores(self, text):
+        """每个智能体的得分 (与其描述/示例的最大余弦相似度)，按得分降序"""
+        self._build()
+        if not len(self._labels):
+            return []
+        similarity = self._matrix @ self._normalize(self.embed(text))
+        best = np.full(len(self._names), -1.0, dtype=np.float32)
+        np.maximum.at(best, self._labels, similarity)
+        order = np.argsort(-best)
+        return [(self._names[i], float(best[i])) for i in order]
+
+    def route(self, text):
+        """返回 (智能体名, 得分, 领先幅度)；没有足够把握时智能体名为 None"""
+        ranked = self.scores(text)
+        if not ranked:
+            return None, 0.0, 0.0
+        name, score = ranked[0]
+        margin = score - ranked[1][1] if len(ranked) > 1 else score
+        if score < self.min_score or margin < self.margin:
+            return None, score, margin
+        return name, score, margin
@@ -1,22 +1,190 @@
 import sys
 import json
 import os
-import pypdf
-import docx
+import time
+import zlib
+import hashlib
+import sqlite3
 import urllib.parse
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # === MCP Server: 文档读取服务器 ===
 # 提供读取 PDF, DOCX, TXT, MD 文件内容的工具
 
-def read_pdf(path):
-    """读取 PDF 文件内容"""
+# 解析进程池：PDF / DOCX 解析是 CPU 密集型，放到多进程中并行
+EXTRACT_WORKERS = int(os.environ.get("MCP_EXTRACT_WORKERS", os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = 32   # 超过该页数的 PDF 按页段并行解析
+HEAVY_EXTENSIONS = {".pdf", ".docx"}
+DEFAULT_MAX_FILES = int(os.environ.get("MCP_MAX_FILES", 30))
+DEFAULT_MAX_TOTAL_CHARS = int(os.environ.get("MCP_MAX_TOTAL_CHARS", 50000))
+FRAME_CHARS = 8000   # 流式模式下每帧最多携带的字符数
+
+# 提取缓存：PDF / DOCX 的解析结果按 (绝对路径, mtime, 大小, 提取器版本) 存入 SQLite，文件未变时直接复用
+# 解析逻辑变化时递增 EXTRACTOR_VERSION，旧条目自然失效并随 LRU 淘汰
+EXTRACTOR_VERSION = 1
+EXTRACT_CACHE_PATH = os.environ.get("MCP_EXTRACT_CACHE", "./extract_cache.sqlite3")  # 设为空字符串关闭缓存
+EXTRACT_CACHE_MAX_BYTES = int(os.environ.get("MCP_EXTRACT_CACHE_BYTES", 512 * 1024 * 1024))
+ERROR_PREFIXES = ("PDF 读取错误", "DOCX 读取错误", "文本读取错误")
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_extract_cache = None  # False 表示缓存已关闭或无法打开
+_extract_cache_lock = threading.Lock()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # 服务进程本身是多线程的，用 spawn 避免 fork 继承锁状态
+            _process_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+class ExtractCache:
+    """提取结果的磁盘缓存：内容 zlib 压缩存储，按最近访问时间做容量淘汰 (多个服务进程可共用同一文件)"""
+    def __init__(self, db_path, max_bytes=EXTRACT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "chars_served": 0, "seconds_saved": 0.0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extracts ("
+            "key TEXT PRIMARY KEY, path TEXT NOT NULL, data BLOB NOT NULL, "
+            "extract_seconds REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_extracts_last_access ON extracts(last_access)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM extracts").fetchone()[0]
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        raw = f"{os.path.abspath(path)}\0{st.st_mtime_ns}\0{st.st_size}\0{EXTRACTOR_VERSION}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT data, extract_seconds FROM extracts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE extracts SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            text = zlib.decompress(row[0]).decode("utf-8")
+            self.stats["hits"] += 1
+            self.stats["chars_served"] += len(text)
+            self.stats["seconds_saved"] += row[1]
+            return text
+
+    def put(self, key, path, text, seconds):
+        data = zlib.compress(text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO extracts VALUES (?, ?, ?, ?, ?)",
+                               (key, os.path.abspath(path), data, seconds, time.time()))
+            self._conn.commit()
+            self.stats["stores"] += 1
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # 其他进程也在写同一文件，先按实际大小重新计算，再按最近访问时间淘汰到上限的 90%
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM extracts").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, LENGTH(data) FROM extracts ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            victims = []
+            for key, size in rows:
+                if self._disk_bytes <= target:
+                    break
+                victims.append((key,))
+                self._disk_bytes -= size
+            self._conn.executemany("DELETE FROM extracts WHERE key = ?", victims)
+            self.stats["evictions"] += len(victims)
+        self._conn.commit()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            entries = self._conn.execute("SELECT COUNT(*) FROM extracts").fetchone()[0]
+            return dict(self.stats, hit_rate=self.stats["hits"] / lookups if lookups else 0.0,
+                        entries=entries, disk_bytes=self._disk_bytes, max_bytes=self.max_bytes,
+                        extractor_version=EXTRACTOR_VERSION)
+
+def get_extract_cache():
+    global _extract_cache
+    with _extract_cache_lock:
+        if _extract_cache is None:
+            _extract_cache = False
+            if EXTRACT_CACHE_PATH:
+                try:
+                    _extract_cache = ExtractCache(EXTRACT_CACHE_PATH)
+                except sqlite3.Error as e:
+                    sys.stderr.write(f"Extract cache disabled: {e}\n")
+        return _extract_cache or None
+
+def _cache_lookup(path):
+    """返回 (缓存键, 缓存内容)；不走缓存的文件 (纯文本 / 缓存关闭) 返回 (None, None)"""
+    if os.path.splitext(path)[1].lower() not in HEAVY_EXTENSIONS:
+        return None, None
+    cache = get_extract_cache()
+    if cache is None:
+        return None, None
     try:
+        key = cache.key(path)
+        return key, cache.get(key)
+    except (OSError, sqlite3.Error):
+        return None, None
+
+def _cache_store(key, path, text, seconds):
+    if key is None or text.startswith(ERROR_PREFIXES):
+        return
+    try:
+        get_extract_cache().put(key, path, text, seconds)
+    except sqlite3.Error as e:
+        sys.stderr.write(f"Extract cache write failed: {e}\n")
+
+def _extract_pdf_pages(path, start, end):
+    import pypdf
+    reader = pypdf.PdfReader(path)
+    parts = []
+    for i in range(start, end):
+        extracted = reader.pages[i].extract_text()
+        if extracted:
+            parts.append(extracted)
+    return parts
+
+def read_pdf(path, parallel=True):
+    """读取 PDF 文件内容 (大文件按页段并行解析)"""
+    try:
+        import pypdf
         reader = pypdf.PdfReader(path)
-        text = ""
-        for page in reader.pages:
-            extracted = page.extract_text()
-            if extracted:
-                text += extracted + "\n"
+        page_count = len(reader.pages)
+        parts = []
+        if parallel and EXTRACT_WORKERS > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+            step = -(-page_count // EXTRACT_WORKERS)
+            ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+            pool = get_process_pool()
+            futures = [pool.submit(_extract_pdf_pages, path, start, end) for start, end in ranges]
+            for future in futures:
+                parts.extend(future.result())
+        else:
+            for page in reader.pages:
+                extracted = page.extract_text()
+                if extracted:
+                    parts.append(extracted)
+        text = "".join(part + "\n" for part in parts)
         
         if not text.strip():
             return "PDF 读取成功，但内容为空 (可能是扫描件或加密)。"
@@ -27,6 +195,7 @@ def read_pdf(path):
 def read_docx(path):
     """读取 DOCX 文件内容"""
     try:
+        import docx
         doc = docx.Document(path)
         text = "\n".join([para.text for para in doc.paragraphs])
         if not text.strip():
@@ -43,48 +212,155 @@ def read_text_file(path):
     except Exception as e:
         return f"文本读取错误: {str(e)}"
 
-def read_folder(path, extensions=[".md", ".txt"]):
-    """递归读取文件夹下的所有指定后缀文件"""
-    combined_text = ""
-    file_count = 0
-    max_files = 30 # 限制一次最多读取 30 个文件
-    max_total_chars = 50000 # 限制总字符数 5万，防止上下文溢出
-    
+def _extract_uncached(path, parallel=True):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf": return read_pdf(path, parallel=parallel)
+    if ext == ".docx": return read_docx(path)
+    return read_text_file(path)
+
+def extract_file(path, parallel=True):
+    """按后缀选择解析器读取单个文件 (PDF / DOCX 先查提取缓存)"""
+    key, text = _cache_lookup(path)
+    if text is not None:
+        return text
+    start = time.perf_counter()
+    text = _extract_uncached(path, parallel)
+    _cache_store(key, path, text, time.perf_counter() - start)
+    return text
+
+def _extract_in_worker(path):
+    # 进程池内不再嵌套按页并行，也不访问缓存 (由服务进程统一读写)
+    start = time.perf_counter()
+    return _extract_uncached(path, parallel=False), time.perf_counter() - start
+
+def list_folder_files(path, extensions, max_files=None):
+    """按确定的顺序 (目录、文件名排序) 列出待读取文件"""
     # 忽略的目录列表
     ignore_dirs = {".git", ".github", "translations", "images", "node_modules", ".devcontainer", "solution"}
+    found = []
+    for root, dirs, files in os.walk(path):
+        # 修改 dirs 列表以跳过忽略的目录 (必须原地修改)
+        dirs[:] = sorted(d for d in dirs if d not in ignore_dirs)
+        for file in sorted(files):
+            if os.path.splitext(file)[1].lower() in extensions:
+                found.append(os.path.join(root, file))
+                if max_files is not None and len(found) >= max_files:
+                    return found
+    return found
+
+def extract_files(paths):
+    """并行解析多个文件，按输入顺序逐个产出 (path, content)
+
+    同时在途的任务数有上限，消费者慢时不会把整个目录的解析结果堆在内存里。
+    """
+    if len(paths) > 1 and any(os.path.splitext(p)[1].lower() in HEAVY_EXTENSIONS for p in paths):
+        pool = get_process_pool()
+        window = EXTRACT_WORKERS * 2
+        # 下标 -> (缓存键, 缓存命中的内容或解析任务)
+        futures = {}
+        try:
+            for i, file_path in enumerate(paths):
+                for j in range(i, min(i + window, len(paths))):
+                    if j not in futures:
+                        key, cached = _cache_lookup(paths[j])
+                        futures[j] = (key, cached if cached is not None else pool.submit(_extract_in_worker, paths[j]))
+                key, item = futures.pop(i)
+                if isinstance(item, str):
+                    yield file_path, item
+                    continue
+                content, seconds = item.result()
+                _cache_store(key, file_path, content, seconds)
+                yield file_path, content
+        finally:
+            for _, item in futures.values():
+                if not isinstance(item, str):
+                    item.cancel()
+    else:
+        for file_path in paths:
+            yield file_path, extract_file(file_path, parallel=False)
+
+def _normalize_extensions(extensions):
+    return {e.lower() if e.startswith(".") else "." + e.lower() for e in extensions}
+
+def _positive_int(args, name):
+    """LLM 常把整数写成字符串 ("3")；无法转换或不是正数时报参数错误"""
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} 应为正整数，收到 {value!r}")
+    if isinstance(value, bool) or number <= 0:
+        raise ValueError(f"{name} 应为正整数，收到 {value!r}")
+    return number
+
+def _folder_args(args):
+    """规范化 read_folder 的可选参数，返回 (extensions, max_files, max_total_chars)"""
+    extensions = args.get("extensions") or (".md", ".txt")
+    if isinstance(extensions, str):
+        # 单个字符串 (".md" 或 ".md,.pdf") 视为后缀列表
+        extensions = [e for e in extensions.replace(",", " ").split() if e]
+    if not isinstance(extensions, (list, tuple)) or not all(isinstance(e, str) and e.strip() for e in extensions):
+        raise ValueError(f"extensions 应为后缀字符串列表，如 [\".md\", \".pdf\"]，收到 {extensions!r}")
+    return [e.strip() for e in extensions], _positive_int(args, "max_files"), _positive_int(args, "max_total_chars")
+
+def read_folder(path, extensions=(".md", ".txt"), max_files=None, max_total_chars=None):
+    """递归读取文件夹下的所有指定后缀文件"""
+    max_files = max_files or DEFAULT_MAX_FILES # 限制一次最多读取的文件数
+    max_total_chars = max_total_chars or DEFAULT_MAX_TOTAL_CHARS # 限制总字符数，防止上下文溢出
+    extensions = _normalize_extensions(extensions)
 
     if not os.path.exists(path):
         return f"目录不存在: {path}"
-        
-    for root, dirs, files in os.walk(path):
-        # 修改 dirs 列表以跳过忽略的目录 (必须原地修改)
-        dirs[:] = [d for d in dirs if d not in ignore_dirs]
-        
-        for file in files:
-            if file_count >= max_files:
-                break
-            ext = os.path.splitext(file)[1].lower()
-            if ext in extensions:
-                file_path = os.path.join(root, file)
-                content = read_text_file(file_path)
-                
-                # 检查是否会超出总字符限制
-                if len(combined_text) + len(content) > max_total_chars:
-                    combined_text += f"\n\n[系统提示] 已达到最大字符数限制 ({max_total_chars})，停止读取更多文件。"
-                    return f"已成功读取目录 {path} 下的前 {file_count} 个文件 (因达到字符限制已截断)。\n" + combined_text
-
-                combined_text += f"\n\n=== FILE: {file} ({file_path}) ===\n\n"
-                combined_text += content
-                file_count += 1
-        
-        if file_count >= max_files:
-            break
+
+    parts = []
+    total_chars = 0
+    file_count = 0
+    for file_path, content in extract_files(list_folder_files(path, extensions, max_files)):
+        # 检查是否会超出总字符限制
+        if total_chars + len(content) > max_total_chars:
+            parts.append(f"\n\n[系统提示] 已达到最大字符数限制 ({max_total_chars})，停止读取更多文件。")
+            return f"已成功读取目录 {path} 下的前 {file_count} 个文件 (因达到字符限制已截断)。\n" + "".join(parts)
+
+        header = f"\n\n=== FILE: {os.path.basename(file_path)} ({file_path}) ===\n\n"
+        parts.append(header)
+        parts.append(content)
+        total_chars += len(header) + len(content)
+        file_count += 1
     
     if file_count == 0:
-        return f"目录 {path} 下没有找到支持的文档文件 ({extensions}) (已忽略 translations 等目录)。"
+        return f"目录 {path} 下没有找到支持的文档文件 ({sorted(extensions)}) (已忽略 translations 等目录)。"
     
     header = f"已成功读取目录 {path} 下的前 {file_count} 个文件 (总文件数可能更多，但为防止上下文溢出已截断)。\n"
-    return header + combined_text
+    return header + "".join(parts)
+
+def _emit_frames(emit, source, content):
+    """把单个文件的内容切成若干帧发出，返回帧数"""
+    frames = 0
+    for start in range(0, max(len(content), 1), FRAME_CHARS):
+        emit({"source": source, "text": content[start:start + FRAME_CHARS]})
+        frames += 1
+    return frames
+
+def stream_document(path, emit):
+    """流式读取单个文档：内容按帧发出，最终结果只包含摘要"""
+    frames = _emit_frames(emit, path, extract_file(path))
+    return f"已流式读取文档 {path} ({frames} 帧)。", {"files": 1, "frames": frames}
+
+def stream_folder(path, emit, extensions=(".md", ".txt"), max_files=None):
+    """流式读取文件夹：逐个文件发帧，不受总字符数限制"""
+    if not os.path.exists(path):
+        return f"目录不存在: {path}", {"files": 0, "frames": 0}
+
+    file_count = 0
+    frames = 0
+    for file_path, content in extract_files(list_folder_files(path, _normalize_extensions(extensions), max_files)):
+        frames += _emit_frames(emit, file_path, content)
+        file_count += 1
+    if file_count == 0:
+        return f"目录 {path} 下没有找到支持的文档文件 ({sorted(_normalize_extensions(extensions))})。", {"files": 0, "frames": 0}
+    return f"已流式读取目录 {path} 下的 {file_count} 个文件 ({frames} 帧)。", {"files": file_count, "frames": frames}
 
 # 定义工具列表
 TOOLS = [
@@ -101,18 +377,27 @@ TOOLS = [
     },
     {
         "name": "read_folder",
-        "description": "递归读取文件夹下的所有文档 (默认支持 .md, .txt)。用于批量学习课程或代码库。",
+        "description": "递归读取文件夹下的所有文档 (默认支持 .md, .txt，可指定 .pdf, .docx 等)。用于批量学习课程或代码库。",
         "inputSchema": {
             "type": "object",
             "properties": {
-                "path": {"type": "string", "description": "文件夹的本地路径"}
+                "path": {"type": "string", "description": "文件夹的本地路径"},
+                "extensions": {"type": "array", "items": {"type": "string"}, "description": "要读取的文件后缀，如 [\".md\", \".pdf\"]"},
+                "max_files": {"type": "integer", "description": "最多读取的文件数"},
+                "max_total_chars": {"type": "integer", "description": "最多读取的总字符数"}
             },
             "required": ["path"]
         }
     }
 ]
 
-def handle_request(request):
+def handle_request(request, emit=None):
+    """处理一条 JSON-RPC 请求
+
+    tools/call 的参数中带 "stream": true 且调用方提供了 emit 时，
+    读取的内容以 notifications/tools/chunk 帧逐个发出，最终响应只携带摘要。
+    参数中的 "window" 是客户端的帧缓冲大小，未确认的帧达到该数量时 emit 会等待 ack。
+    """
     method = request.get("method")
     params = request.get("params", {})
     msg_id = request.get("id")
@@ -132,9 +417,15 @@ def handle_request(request):
     elif method == "tools/list":
         response["result"] = {"tools": TOOLS}
 
+    elif method == "cache/stats":
+        # 提取缓存的命中统计 (本进程) 与磁盘占用
+        cache = get_extract_cache()
+        response["result"] = {"enabled": cache is not None, "stats": cache.snapshot() if cache else None}
+
     elif method == "tools/call":
         name = params.get("name")
         args = params.get("arguments", {})
+        stream = bool(params.get("stream")) and emit is not None
         
         if name == "read_document":
             raw_path = args.get("path", "")
@@ -145,12 +436,11 @@ def handle_request(request):
             
             if not os.path.exists(path):
                 response["result"] = {"content": [{"type": "text", "text": f"文件不存在: {path}"}]}
+            elif stream:
+                summary, stats = stream_document(path, emit)
+                response["result"] = dict({"content": [{"type": "text", "text": summary}]}, **stats)
             else:
-                ext = os.path.splitext(path)[1].lower()
-                content = ""
-                if ext == ".pdf": content = read_pdf(path)
-                elif ext == ".docx": content = read_docx(path)
-                else: content = read_text_file(path)
+                content = extract_file(path)
                 response["result"] = {"content": [{"type": "text", "text": content}]}
 
         elif name == "read_folder":
@@ -160,8 +450,19 @@ def handle_request(request):
                 decoded_path = urllib.parse.unquote(path)
                 if os.path.exists(decoded_path): path = decoded_path
 
-            content = read_folder(path)
-            response["result"] = {"content": [{"type": "text", "text": content}]}
+            try:
+                extensions, max_files, max_total_chars = _folder_args(args)
+            except ValueError as e:
+                # 参数错误作为工具结果返回，模型可以据此修正后重试
+                response["result"] = {"content": [{"type": "text", "text": f"参数错误: {e}"}], "isError": True}
+            else:
+                if stream:
+                    summary, stats = stream_folder(path, emit, extensions=extensions, max_files=max_files)
+                    response["result"] = dict({"content": [{"type": "text", "text": summary}]}, **stats)
+                else:
+                    content = read_folder(path, extensions=extensions, max_files=max_files,
+                                          max_total_chars=max_total_chars)
+                    response["result"] = {"content": [{"type": "text", "text": content}]}
             
         else:
             response["error"] = {"code": -32601, "message": "Method not found"}
@@ -171,21 +472,107 @@ def handle_request(request):
 
     return response
 
+_write_lock = threading.Lock()
+
+# 流式调用的信用额度 (请求 id -> _StreamCredits)：客户端每消费若干帧发送
+# notifications/tools/ack 归还额度，服务端在额度用完时暂停发帧，背压不占用客户端的共享读取线程
+_stream_credits = {}
+_credits_lock = threading.Lock()
+_shutdown = threading.Event()
+
+class StreamCancelled(Exception):
+    pass
+
+class _StreamCredits:
+    def __init__(self, window):
+        self.available = threading.Semaphore(window)
+        self.cancelled = False
+
+    def acquire(self):
+        while not self.available.acquire(timeout=0.5):
+            if self.cancelled or _shutdown.is_set():
+                break
+        if self.cancelled or _shutdown.is_set():
+            raise StreamCancelled("客户端已取消流式调用")
+
+def _handle_ack(params):
+    with _credits_lock:
+        credits = _stream_credits.get(params.get("requestId"))
+    if credits is None:
+        return
+    if params.get("cancel"):
+        credits.cancelled = True
+        credits.available.release()
+        return
+    for _ in range(max(0, int(params.get("frames", 0)))):
+        credits.available.release()
+
+def _write_message(message):
+    with _write_lock:
+        print(json.dumps(message), flush=True)
+
+def _register_credits(request):
+    """流式调用带 window 参数时登记信用额度 (在读取线程中登记，保证先于该请求的 ack / 取消)"""
+    params = request.get("params") or {}
+    if not (params.get("stream") and params.get("window")):
+        return None
+    credits = _StreamCredits(int(params["window"]))
+    with _credits_lock:
+        _stream_credits[request.get("id")] = credits
+    return credits
+
+def _serve_one(request, credits=None):
+    msg_id = request.get("id")
+    seq = itertools.count()
+
+    def emit(frame):
+        if credits is not None:
+            credits.acquire()
+        _write_message({
+            "jsonrpc": "2.0",
+            "method": "notifications/tools/chunk",
+            "params": dict(frame, requestId=msg_id, seq=next(seq))
+        })
+
+    try:
+        response = handle_request(request, emit)
+        if response:
+            # 响应按完成顺序写回，客户端按 id 匹配
+            _write_message(response)
+    except StreamCancelled:
+        pass  # 客户端已不再等待这次调用
+    except Exception as e:
+        sys.stderr.write(f"Error processing request: {e}\n")
+        if msg_id is not None:
+            # 必须回复，否则客户端要等满整个超时；流式调用的帧队列也靠这条响应结束
+            _write_message({"jsonrpc": "2.0", "id": msg_id,
+                            "error": {"code": -32603, "message": f"{type(e).__name__}: {e}"}})
+    finally:
+        if credits is not None:
+            with _credits_lock:
+                _stream_credits.pop(msg_id, None)
+
 def main():
     if sys.platform == 'win32':
         import io
         sys.stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
         sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-    for line in sys.stdin:
-        try:
-            if not line.strip(): continue
-            request = json.loads(line)
-            response = handle_request(request)
-            if response:
-                print(json.dumps(response), flush=True)
-        except Exception as e:
-            sys.stderr.write(f"Error processing request: {e}\n")
+    workers = int(os.environ.get("MCP_SERVER_WORKERS", min(8, (os.cpu_count() or 1) + 4)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mcp-worker") as pool:
+        for line in sys.stdin:
+            try:
+                if not line.strip(): continue
+                request = json.loads(line)
+                if request.get("method") == "notifications/tools/ack":
+                    # 额度归还在读取线程中直接处理，不能排在 (可能正等待额度的) 工作线程后面
+                    _handle_ack(request.get("params", {}))
+                    continue
+                pool.submit(_serve_one, request, _register_credits(request))
+            except Exception as e:
+                sys.stderr.write(f"Error processing request: {e}\n")
+        # stdin 关闭：唤醒仍在等待额度的流式调用
+        _shutdown.set()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from core import tracing
+
+# === 多会话 HTTP 服务 ===
+# asyncio 上的最小 HTTP/1.1 接口：有界等待队列 + 固定数量的工作协程，
+# 队列满时立即返回 503 (背压)，会话空闲后换出到磁盘
+
+MAX_BODY_BYTES = 1024 * 1024
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class AgentService:
+    def __init__(self, orchestrator, sessions, workers=8, queue_size=64, request_timeout=600, evict_interval=30,
+                 reloader=None):
+        self.orchestrator = orchestrator
+        # 配置热重载替换编排器时只改这一个引用：已在处理的请求继续用旧对象，之后出队的请求用新对象
+        self.reloader = reloader
+        if reloader:
+            reloader.listeners.append(self._swap_orchestrator)
+        self.sessions = sessions
+        self.workers = workers
+        self.queue_size = queue_size
+        self.request_timeout = request_timeout
+        self.evict_interval = evict_interval
+        self.queue = None
+        self._tasks = []
+        self.busy = 0
+        self.latencies = deque(maxlen=1000)
+        self.stats = {"requests": 0, "completed": 0, "rejected": 0, "failed": 0, "timeouts": 0}
+
+    def _swap_orchestrator(self, orchestrator):
+        self.orchestrator = orchestrator
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        # 检索 / 上下文压缩等阻塞步骤走默认线程池，按工作协程数放大，避免成为并发瓶颈
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=max(32, self.workers * 4), thread_name_prefix="service"))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._evict_loop()))
+        server = await asyncio.start_server(self._handle_client, host, port)
+        print(f"🌐 服务已启动: http://{host}:{server.sockets[0].getsockname()[1]} "
+              f"(工作协程 {self.workers}，队列上限 {self.queue_size})")
+        return server
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.sessions.flush()
+
+    async def _worker(self):
+        while True:
+            session, message, future = await self.queue.get()
+            self.busy += 1
+            try:
+                if future.done():
+                    continue  # 客户端已超时放弃
+                async with session.lock:
+                    reply = await self.orchestrator.aprocess(message, session, raise_errors=True)
+                if not future.done():
+                    future.set_result(reply)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.busy -= 1
+                self.sessions.release(session)
+                self.queue.task_done()
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            evicted = await asyncio.to_thread(self.sessions.evict_idle)
+            if evicted:
+                print(f"  💾 已将 {evicted} 个空闲会话换出到磁盘")
+
+    async def chat(self, message, session_id=None):
+        """提交一条消息；队列已满时抛出 HTTPError(503)"""
+        self.stats["requests"] += 1
+        try:
+            session = self.sessions.acquire(session_id)
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((session, message, future))
+        except asyncio.QueueFull:
+            self.sessions.release(session)
+            self.stats["rejected"] += 1
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, "服务繁忙，请稍后重试")
+
+        started = time.perf_counter()
+        try:
+            reply = await asyncio.wait_for(asyncio.shield(future), self.request_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.stats["timeouts"] += 1
+            raise HTTPError(HTTPStatus.GATEWAY_TIMEOUT, "处理超时")
+        except Exception as e:
+            self.stats["failed"] += 1
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+        elapsed = time.perf_counter() - started
+        self.latencies.append(elapsed)
+        self.stats["completed"] += 1
+        return {"session_id": session.session_id, "reply": reply, "seconds": round(elapsed, 3)}
+
+    def metrics(self):
+        samples = sorted(self.latencies)
+        latency = {}
+        if samples:
+            latency = {
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            }
+        return {
+            "service": dict(self.stats, queued=self.queue.qsize() if self.queue else 0, busy=self.busy,
+                            workers=self.workers, latency=latency),
+            "sessions": self.sessions.metrics(),
+            "routing": self.orchestrator.routing_metrics(),
+            "llm": self.orchestrator.llm.metrics(),
+            "models": self.orchestrator.llm.models.metrics() if self.orchestrator.llm.models else None,
+            "mcp": self._mcp_metrics(),
+            "embedding": self._embedding_metrics(),
+            "reload": self.reloader.metrics() if self.reloader else None,
+            "spans": tracing.get_tracer().snapshot()
+        }
+
+    def _mcp_metrics(self):
+        for agent in self.orchestrator.agents.values():
+            if agent.mcp_client:
+                return dict(agent.mcp_client.metrics(), extract_cache=agent.mcp_client.extract_cache_stats())
+        return None
+
+    def _embedding_metrics(self):
+        for agent in self.orchestrator.agents.values():
+            if agent.memory_sys:
+                return dict(agent.memory_sys.engine.metrics(), backend=agent.memory_sys.embedding_backend)
+        return None
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            # 汇总 MCP 提取缓存需要向服务进程发请求，放到线程中避免阻塞事件循环
+            return await asyncio.to_thread(self.metrics)
+        if method == "GET" and path == "/metrics":
+            return tracing.get_tracer().prometheus()
+        if method == "POST" and path == "/chat":
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "请求体不是合法的 JSON")
+            if not isinstance(data, dict) or not str(data.get("message", "")).strip():
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "缺少 message 字段")
+            return await self.chat(str(data["message"]), data.get("session_id"))
+        if method == "DELETE" and path.startswith("/sessions/"):
+            if not self.sessions.drop(path[len("/sessions/"):]):
+                raise HTTPError(HTTPStatus.NOT_FOUND, "会话不存在")
+            return {"deleted": True}
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"未知的接口: {method} {path}")
+
+    async def _handle_client(self, reader, writer):
+        status, payload = HTTPStatus.OK, None
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                writer.close()
+                return
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "请求体过大")
+            body = await reader.readexactly(length) if length else b""
+            payload = await self._route(method.upper(), path.split("?", 1)[0], body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": "无法解析的 HTTP 请求"}
+
+        if isinstance(payload, str):
+            # /metrics 以 Prometheus 文本格式返回
+            data, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                + ("Retry-After: 1\r\n" if status == HTTPStatus.SERVICE_UNAVAILABLE else "")
+                + "Connection: close\r\n\r\n")
+        try:
+            writer.write(head.encode("latin-1") + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+async def serve(orchestrator, sessions, host="127.0.0.1", port=8080, reloader=None, **kwargs):
+    """启动服务并一直运行，直到被取消 (Ctrl+C)"""
+    service = AgentService(orchestrator, sessions, reloader=reloader, **kwargs)
+    server = await service.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+# === 会话状态 ===
+# 服务模式下每个用户会话各自持有 Manager 与各专家的 history，智能体定义本身在会话间共享
+
+MANAGER_KEY = "__manager__"
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def _sync_system_prompt(history, system_prompt):
+    """配置热重载后智能体的 system prompt 可能已变，会话 history 的首条系统消息随之更新"""
+    if history and history[0].get("role") == "system" and history[0].get("content") != system_prompt:
+        history[0] = {"role": "system", "content": system_prompt}
+    return history
+
+class Session:
+    def __init__(self, session_id, histories=None, created=None):
+        self.session_id = session_id
+        self.histories = histories or {}
+        self.created = created or time.time()
+        self.last_active = time.time()
+        self.requests = 0
+        self.pending = 0  # 已排队或正在处理的请求数，大于 0 时不会被换出
+        self.last_agent = None  # 最近一次请求由谁处理 (智能体名或 "Manager")
+        # 同一会话的请求按顺序处理，不同会话之间并发
+        self.lock = asyncio.Lock()
+
+    def manager_history(self, orchestrator):
+        if MANAGER_KEY not in self.histories:
+            self.histories[MANAGER_KEY] = orchestrator.new_history()
+        return _sync_system_prompt(self.histories[MANAGER_KEY], orchestrator.system_prompt)
+
+    def agent_history(self, name, agent):
+        if name not in self.histories:
+            self.histories[name] = agent.new_history()
+        return _sync_system_prompt(self.histories[name], agent.system_prompt)
+
+    def touch(self):
+        self.last_active = time.time()
+
+    def to_dict(self):
+        return {"session_id": self.session_id, "created": self.created, "histories": self.histories}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["session_id"], histories=data.get("histories"), created=data.get("created"))
+
+class SessionStore:
+    """内存中的活跃会话 + 磁盘上换出的空闲会话 (每个会话一个 JSON 文件)"""
+    def __init__(self, path="./sessions", idle_seconds=900, max_sessions=1000):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "evicted": 0, "restored": 0}
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, session_id):
+        # 会话 id 可能来自 URL，所有磁盘路径都在这里校验，防止 "../" 之类逃出会话目录
+        if not isinstance(session_id, str) or not _SESSION_ID.match(session_id):
+            raise ValueError(f"非法的会话 id: {session_id}")
+        return os.path.join(self.path, f"{session_id}.json")
+
+    def acquire(self, session_id=None):
+        """取得会话并登记一个进行中的请求 (处理完后调用 release)
+
+        内存中没有时从磁盘恢复，都没有则新建。
+        """
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        if not isinstance(session_id, str) or not _SESSION_ID.match(session_id):
+            raise ValueError(f"非法的会话 id: {session_id}")
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._restore(session_id)
+                if session is None:
+                    session = Session(session_id)
+                    self.stats["created"] += 1
+                self._sessions[session_id] = session
+            session.pending += 1
+            session.touch()
+        if len(self._sessions) > self.max_sessions:
+            self.evict_idle(force=len(self._sessions) - self.max_sessions)
+        return session
+
+    def release(self, session):
+        with self._lock:
+            session.pending -= 1
+            session.requests += 1
+            session.touch()
+
+    def _restore(self, session_id):
+        file_path = self._file(session_id)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "r", encoding="utf-8") as f:
+            session = Session.from_dict(json.load(f))
+        os.remove(file_path)
+        self.stats["restored"] += 1
+        return session
+
+    def _write(self, session):
+        file_path = self._file(session.session_id)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, file_path)
+
+    def evict_idle(self, force=0):
+        """把空闲超时的会话写入磁盘并移出内存；force 指定至少额外换出的最久未用会话数"""
+        now = time.time()
+        with self._lock:
+            idle = sorted((s for s in self._sessions.values() if not s.pending), key=lambda s: s.last_active)
+            victims = [s for s in idle if now - s.last_active > self.idle_seconds]
+            victims += [s for s in idle if s not in victims][:max(0, force - len(victims))]
+            for session in victims:
+                self._write(session)
+                del self._sessions[session.session_id]
+            self.stats["evicted"] += len(victims)
+        return len(victims)
+
+    def drop(self, session_id):
+        """删除会话 (内存与磁盘)；会话不存在或 id 非法时返回 False"""
+        if not isinstance(session_id, str) or not _SESSION_ID.match(session_id):
+            return False
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            file_path = self._file(session_id)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                return True
+            return session is not None
+
+    def flush(self):
+        """停止服务前把所有活跃会话写入磁盘"""
+        with self._lock:
+            for session in self._sessions.values():
+                self._write(session)
+
+    def metrics(self):
+        with self._lock:
+            on_disk = sum(1 for name in os.listdir(self.path) if name.endswith(".json"))
+            return dict(self.stats, active=len(self._sessions), on_disk=on_disk)
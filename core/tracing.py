@@ -0,0 +1,207 @@
+import contextvars
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+# === 请求链路追踪 ===
+# 各阶段 (路由 / 嵌入 / 检索 / LLM / 工具 / 入库) 包在 span 里，记录耗时、token 数与载荷大小；
+# 采样在每条链路的根 span 决定，未采样的链路上所有 span 都是空操作
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current = contextvars.ContextVar("uark_current_span", default=None)
+_SUPPRESSED = object()  # 当前链路未被采样
+
+class _NoopSpan:
+    def set(self, key=None, value=None, **attrs):
+        pass
+
+    def begin(self):
+        return self
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NOOP = _NoopSpan()
+
+class _SuppressedRoot(_NoopSpan):
+    """未采样的根 span：让同一链路内的子 span 直接走空操作"""
+    def __enter__(self):
+        self._token = _current.set(_SUPPRESSED)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            pass
+        return False
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "started_at", "start", "duration",
+                 "attrs", "_token")
+
+    def __init__(self, tracer, name, parent, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else tracer.new_id()
+        self.span_id = tracer.new_id()
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs
+        self.duration = None
+
+    def set(self, key=None, value=None, **attrs):
+        """记录属性 (耗时以外的 token 数、字节数等)"""
+        if key is not None:
+            self.attrs[key] = value
+        self.attrs.update(attrs)
+
+    def begin(self):
+        """开始计时但不成为当前 span (用于生成器：避免调用方在两次 next 之间创建的 span 挂到它下面)"""
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def end(self, error=None):
+        self.duration = time.perf_counter() - self.start
+        if error is not None:
+            self.attrs["error"] = error
+        self.tracer._finish(self)
+
+    def __enter__(self):
+        self.begin()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            pass  # 异步生成器在别的上下文中被关闭 (消费者提前退出)
+        self.end(exc_type.__name__ if exc_type is not None else None)
+        return False
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs
+        }
+
+class Tracer:
+    def __init__(self, enabled=False, sample_rate=1.0, export_path=None, buckets=BUCKETS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.export_path = export_path
+        self.buckets = tuple(buckets)
+        self._ids = itertools.count(1)
+        self._prefix = f"{os.getpid():x}-{random.getrandbits(32):08x}"
+        self._lock = threading.Lock()
+        self._file = None
+        # span 名 -> {"counts": [...], "sum": 秒, "count": 次数, "attrs": {数值属性累计}}
+        self._histograms = {}
+
+    def new_id(self):
+        return f"{self._prefix}-{next(self._ids):x}"
+
+    def span(self, name, **attrs):
+        """with tracer.span("agent.llm", agent=...) as span: ...; span.set(prompt_tokens=...)"""
+        if not self.enabled:
+            return _NOOP
+        parent = _current.get()
+        if parent is _SUPPRESSED:
+            return _NOOP
+        if parent is None and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return _SuppressedRoot()
+        return Span(self, name, parent, attrs)
+
+    def _finish(self, span):
+        with self._lock:
+            hist = self._histograms.get(span.name)
+            if hist is None:
+                hist = self._histograms[span.name] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0,
+                                                      "count": 0, "attrs": {}}
+            hist["counts"][bisect_left(self.buckets, span.duration)] += 1
+            hist["sum"] += span.duration
+            hist["count"] += 1
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    hist["attrs"][key] = hist["attrs"].get(key, 0) + value
+            if self.export_path:
+                if self._file is None:
+                    self._file = open(self.export_path, "a", encoding="utf-8")
+                self._file.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+                if span.parent_id is None:
+                    self._file.flush()
+
+    def snapshot(self):
+        """各 span 的直方图快照：次数、总耗时、分桶计数与数值属性累计"""
+        with self._lock:
+            return {
+                name: {
+                    "count": hist["count"],
+                    "sum_seconds": hist["sum"],
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], itertools.accumulate(hist["counts"]))),
+                    "attrs": dict(hist["attrs"])
+                } for name, hist in self._histograms.items()
+            }
+
+    def prometheus(self, prefix="uark"):
+        """Prometheus 文本格式的指标"""
+        lines = [f"# TYPE {prefix}_span_duration_seconds histogram"]
+        counters = []
+        for name, hist in sorted(self.snapshot().items()):
+            for le, count in hist["buckets"].items():
+                lines.append(f'{prefix}_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_span_duration_seconds_sum{{span="{name}"}} {hist["sum_seconds"]:.6f}')
+            lines.append(f'{prefix}_span_duration_seconds_count{{span="{name}"}} {hist["count"]}')
+            for attr, value in sorted(hist["attrs"].items()):
+                counters.append(f'{prefix}_span_attribute_total{{span="{name}",attr="{attr}"}} {value}')
+        if counters:
+            lines.append(f"# TYPE {prefix}_span_attribute_total counter")
+            lines.extend(counters)
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+_tracer = Tracer()
+
+def configure(**kwargs):
+    """按配置 (agents.yaml 的 tracing 段) 重建全局 tracer"""
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(**kwargs)
+    return _tracer
+
+def get_tracer():
+    return _tracer
+
+def span(name, **attrs):
+    return _tracer.span(name, **attrs)
+
+def current_span():
+    """当前生效的 span (可用于在深层调用中补充属性)；不在采样链路中时返回空操作对象"""
+    current = _current.get()
+    return current if isinstance(current, Span) else _NOOP
@@ -0,0 +1,418 @@
+import json
+import os
+import threading
+
+# === 向量存储后端 ===
+# MemorySystem 通过统一接口访问集合：ChromaDB (默认) 或进程内 NumPy 内存映射矩阵
+
+def match_where(metadata, where):
+    """在 Python 侧求值 Chroma 风格的 where 过滤条件"""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(match_where(metadata, c) for c in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            try:
+                if op == "$eq" and not value == expected: return False
+                if op == "$ne" and not value != expected: return False
+                if op == "$gt" and not (value is not None and value > expected): return False
+                if op == "$gte" and not (value is not None and value >= expected): return False
+                if op == "$lt" and not (value is not None and value < expected): return False
+                if op == "$lte" and not (value is not None and value <= expected): return False
+                if op == "$in" and value not in expected: return False
+                if op == "$nin" and value in expected: return False
+            except TypeError:
+                return False
+    return True
+
+QUANTIZATIONS = {
+    "float16": {"suffix": "f16", "dtype": "float16"},
+    "int8": {"suffix": "i8", "dtype": "int8"},
+}
+
+def quantize(vectors, quantization):
+    """把单位向量压缩为 float16 或 int8 (每个向量一个 float32 缩放系数)"""
+    import numpy as np
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class VectorStore:
+    """单个集合的存储接口；距离统一为 L2 平方 (与 Chroma 默认一致)"""
+    def count(self):
+        raise NotImplementedError
+
+    def existing_ids(self, ids):
+        raise NotImplementedError
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        """返回 {"ids", "documents", "metadatas"[, "embeddings"]}"""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def query(self, embedding, n_results, where=None):
+        """返回按距离升序排列的 [{"id", "document", "metadata", "distance"}]"""
+        raise NotImplementedError
+
+    def persist(self):
+        pass
+
+class ChromaStore(VectorStore):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collection = client.get_or_create_collection(name=name)
+        # 缓存条目数，只在写入后刷新，避免每次检索前都多一次 count() 往返
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.collection.count()
+        return self._count
+
+    def existing_ids(self, ids):
+        return set(self.collection.get(ids=list(ids), include=[])["ids"])
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        self._count = None
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        if ids is not None:
+            result = self.collection.get(ids=list(ids), include=include)
+        else:
+            result = self.collection.get(limit=limit, offset=offset, include=include)
+        data = {"ids": result["ids"], "documents": result["documents"], "metadatas": result["metadatas"]}
+        if include_embeddings:
+            data["embeddings"] = result["embeddings"]
+        return data
+
+    def delete(self, ids):
+        self.collection.delete(ids=list(ids))
+        self._count = None
+
+    def query(self, embedding, n_results, where=None):
+        count = self.count()
+        if count == 0:
+            return []
+        results = self.collection.query(
+            query_embeddings=[embedding],
+            n_results=min(n_results, count),
+            where=where or None,
+            include=["documents", "metadatas", "distances"]
+        )
+        hits = []
+        if results["ids"]:
+            for i, record_id in enumerate(results["ids"][0]):
+                hits.append({
+                    "id": record_id,
+                    "document": results["documents"][0][i],
+                    "metadata": results["metadatas"][0][i] if results.get("metadatas") else None,
+                    "distance": results["distances"][0][i] if results.get("distances") else None
+                })
+        return hits
+
+    def persist(self):
+        if hasattr(self.client, 'persist'):
+            self.client.persist()
+
+class NumpyStore(VectorStore):
+    """追加写入的内存映射矩阵 + JSONL 元数据，检索为分块批量点积
+
+    目录结构:
+      meta.json      向量维度等元信息
+      vectors.f32    行优先的 float32 向量 (只追加)
+      records.jsonl  每行一条写入/删除记录，第 N 条写入记录对应 vectors.f32 的第 N 行
+      vectors.f16 / vectors.i8 + scales.f32
+                     量化副本 (quantization 开启时)，可随时由 vectors.f32 重建
+
+    开启量化后全量扫描只读取量化矩阵，float32 原始向量仅用于对前
+    n_results * rerank_factor 个候选做精确重排，扫描的常驻内存约为原来的 1/2 (float16)
+    或 1/4 (int8)。这是用延迟换内存：量化块要先解码成 float32 再做点积，外加一次重排，
+    NumPy 下检索比 float32 更慢 (int8 约 2 倍，float16 约 8-10 倍，见 scripts/bench_vector_backends.py)。
+    """
+    SCAN_BLOCK = 65536
+    # 量化矩阵按小块解码为 float32，临时缓冲保持在 CPU 缓存范围内
+    QUANT_SCAN_BLOCK = 1024
+
+    def __init__(self, path, dim=None, quantization=None, rerank_factor=4):
+        import numpy as np
+        if quantization not in (None, "float32") and quantization not in QUANTIZATIONS:
+            raise ValueError(f"未知的量化方式: {quantization}")
+        self.np = np
+        self.path = path
+        self.dim = dim
+        self.quantization = None if quantization == "float32" else quantization
+        self.rerank_factor = max(1, int(rerank_factor))
+        os.makedirs(path, exist_ok=True)
+        self._meta_path = os.path.join(path, "meta.json")
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._records_path = os.path.join(path, "records.jsonl")
+        if self.quantization:
+            self._codes_path = os.path.join(path, "vectors." + QUANTIZATIONS[self.quantization]["suffix"])
+            self._scales_path = os.path.join(path, "scales.f32")
+        self._lock = threading.RLock()
+
+        self._rows = 0
+        self._row_of = {}      # id -> 行号 (仅存活条目)
+        self._ids = []         # 行号 -> id
+        self._documents = []
+        self._metadatas = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._matrix = None    # 当前映射的只读视图
+        self._codes = None     # 量化矩阵的只读视图
+        self._scales = None
+        self._load()
+
+    def _load(self):
+        np = self.np
+        alive = []
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+        if os.path.exists(self._records_path):
+            valid_bytes = 0
+            with open(self._records_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # 崩溃留下的半行记录 (每条记录连同换行符一次写入)
+                    if not line.strip():
+                        valid_bytes += len(line)
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_bytes += len(line)
+                    if record.get("deleted"):
+                        row = self._row_of.pop(record["id"], None)
+                        if row is not None:
+                            alive[row] = False
+                        continue
+                    old = self._row_of.get(record["id"])
+                    if old is not None:
+                        alive[old] = False
+                    self._row_of[record["id"]] = len(self._ids)
+                    self._ids.append(record["id"])
+                    self._documents.append(record.get("document"))
+                    self._metadatas.append(record.get("metadata"))
+                    alive.append(True)
+            # 截掉半行及其后的内容，否则下次追加会接在半行后面，整行 (及之后的记录) 都无法解析
+            if valid_bytes != os.path.getsize(self._records_path):
+                with open(self._records_path, "r+b") as f:
+                    f.truncate(valid_bytes)
+        self._rows = len(self._ids)
+        if self.dim:
+            # 向量文件可能比记录多出半写的尾部 (崩溃)，以记录为准
+            on_disk = os.path.getsize(self._vectors_path) // (4 * self.dim) if os.path.exists(self._vectors_path) else 0
+            if on_disk < self._rows:
+                raise ValueError(f"向量文件不完整: {self._vectors_path}")
+            if on_disk > self._rows:
+                with open(self._vectors_path, "r+b") as f:
+                    f.truncate(self._rows * 4 * self.dim)
+        self._alive = np.array(alive, dtype=bool)
+        self._matrix = None
+        if self.quantization and self.dim:
+            self._sync_quantized()
+
+    def _sync_quantized(self):
+        """让量化副本与 vectors.f32 行数一致：截掉多余尾部，缺失部分从 float32 补齐"""
+        np = self.np
+        itemsize = np.dtype(QUANTIZATIONS[self.quantization]["dtype"]).itemsize
+        row_bytes = itemsize * self.dim
+        on_disk = os.path.getsize(self._codes_path) // row_bytes if os.path.exists(self._codes_path) else 0
+        if self.quantization == "int8":
+            scales_on_disk = os.path.getsize(self._scales_path) // 4 if os.path.exists(self._scales_path) else 0
+            on_disk = min(on_disk, scales_on_disk)
+        on_disk = min(on_disk, self._rows)
+        files = [(self._codes_path, on_disk * row_bytes)]
+        if self.quantization == "int8":
+            files.append((self._scales_path, on_disk * 4))
+        for file_path, size in files:
+            if os.path.exists(file_path) and os.path.getsize(file_path) != size:
+                with open(file_path, "r+b") as f:
+                    f.truncate(size)
+        if on_disk < self._rows:
+            matrix = self._mapped()
+            for start in range(on_disk, self._rows, self.SCAN_BLOCK):
+                self._append_quantized(np.asarray(matrix[start:start + self.SCAN_BLOCK]))
+        self._codes = None
+
+    def _append_quantized(self, vectors):
+        codes, scales = quantize(vectors, self.quantization)
+        with open(self._codes_path, "ab") as f:
+            f.write(codes.tobytes())
+        if scales is not None:
+            with open(self._scales_path, "ab") as f:
+                f.write(scales.tobytes())
+
+    def _mapped_quantized(self):
+        np = self.np
+        if self._codes is None or self._codes.shape[0] != self._rows:
+            dtype = QUANTIZATIONS[self.quantization]["dtype"]
+            self._codes = np.memmap(self._codes_path, dtype=dtype, mode="r", shape=(self._rows, self.dim))
+            if self.quantization == "int8":
+                self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(self._rows,))
+        return self._codes, self._scales
+
+    def _mapped(self):
+        np = self.np
+        if self._rows == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != self._rows:
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim))
+        return self._matrix
+
+    def _normalize(self, embeddings):
+        np = self.np
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def count(self):
+        return len(self._row_of)
+
+    def existing_ids(self, ids):
+        with self._lock:
+            return {i for i in ids if i in self._row_of}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        np = self.np
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._meta_path, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: {vectors.shape[1]} != {self.dim}")
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            if self.quantization:
+                self._append_quantized(vectors)
+
+            base = len(self._ids)
+            alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for record_id, document, metadata in zip(ids, documents, metadatas):
+                    old = self._row_of.get(record_id)
+                    if old is not None:
+                        alive[old] = False
+                    self._row_of[record_id] = len(self._ids)
+                    self._ids.append(record_id)
+                    self._documents.append(document)
+                    self._metadatas.append(metadata)
+                    f.write(json.dumps({"id": record_id, "document": document,
+                                        "metadata": metadata}, ensure_ascii=False) + "\n")
+            self._rows = base + len(ids)
+            self._alive = alive
+
+    def get(self, ids=None, limit=None, offset=0, include_embeddings=False):
+        with self._lock:
+            if ids is not None:
+                rows = [self._row_of[i] for i in ids if i in self._row_of]
+            else:
+                rows = sorted(self._row_of.values())
+                rows = rows[offset:offset + limit if limit is not None else None]
+            data = {
+                "ids": [self._ids[r] for r in rows],
+                "documents": [self._documents[r] for r in rows],
+                "metadatas": [self._metadatas[r] for r in rows]
+            }
+            if include_embeddings:
+                matrix = self._mapped()
+                data["embeddings"] = [matrix[r].tolist() for r in rows]
+            return data
+
+    def delete(self, ids):
+        with self._lock:
+            with open(self._records_path, "a", encoding="utf-8") as f:
+                for record_id in ids:
+                    row = self._row_of.pop(record_id, None)
+                    if row is not None:
+                        self._alive[row] = False
+                        f.write(json.dumps({"id": record_id, "deleted": True}) + "\n")
+
+    def query(self, embedding, n_results, where=None):
+        np = self.np
+        with self._lock:
+            # 只在锁内取快照；追加写入不会改动已有行，矩阵运算可以与写入并行
+            if not self._row_of:
+                return []
+            rows = self._rows
+            matrix = self._mapped()
+            mask = self._alive[:rows].copy()
+            metadatas = self._metadatas[:rows]
+
+            if self.quantization:
+                codes, scales = self._mapped_quantized()
+
+        query = self._normalize(embedding)[0]
+        if where:
+            mask &= np.fromiter((match_where(m, where) for m in metadatas), dtype=bool, count=rows)
+        k = min(n_results, int(mask.sum()))
+        if k <= 0:
+            return []
+
+        scores = np.empty(rows, dtype=np.float32)
+        block = self.QUANT_SCAN_BLOCK if self.quantization else self.SCAN_BLOCK
+        for start in range(0, rows, block):
+            end = min(start + block, rows)
+            if not self.quantization:
+                scores[start:end] = matrix[start:end] @ query
+            elif self.quantization == "float16":
+                scores[start:end] = codes[start:end].astype(np.float32) @ query
+            else:
+                scores[start:end] = (codes[start:end].astype(np.float32) @ query) * scales[start:end]
+        scores[~mask] = -np.inf
+
+        if self.quantization:
+            # 量化分数只用来圈定候选，最终排序用 float32 原始向量精确计算
+            n_candidates = min(k * self.rerank_factor, int(mask.sum()))
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            candidates.sort()
+            scores = np.full(rows, -np.inf, dtype=np.float32)
+            scores[candidates] = matrix[candidates] @ query
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        else:
+            top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{
+            "id": self._ids[r],
+            "document": self._documents[r],
+            "metadata": self._metadatas[r],
+            "distance": float(2.0 - 2.0 * scores[r])
+        } for r in top]
+
+    def persist(self):
+        # 写入即落盘 (追加文件)，这里只需让下次检索重新映射
+        self._matrix = None
+        self._codes = None
+
+def list_numpy_collections(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.exists(os.path.join(root, d, "records.jsonl")))
@@ -1,50 +1,229 @@
+import argparse
+import asyncio
 import yaml
 import sys
 import os
-from core.memory import MemorySystem
+import time
+from core.memory import MemorySystem, memory_options
 from core.mcp import MCPClient
 from core.agent import GenericAgent
 from core.orchestrator import Orchestrator
+from core.router import EmbeddingRouter
+from core.session import SessionStore
+from core.service import serve
+from core.batch import BatchRunner, print_report
+from core.reload import HotReloader
+from core import llm, tracing
+from core.models import DEFAULT_MODEL, ModelManager, configured_models
 
-def load_config(path="config/agents.yaml"):
+CONFIG_PATH = "config/agents.yaml"
+
+def load_config(path=CONFIG_PATH):
     with open(path, 'r', encoding='utf-8') as f:
         return yaml.safe_load(f)
 
+def default_model(config):
+    return config.get("models", {}).get("default", DEFAULT_MODEL)
+
+def build_agent(agent_cfg, mcp_client, memory_sys, model=DEFAULT_MODEL):
+    model = agent_cfg.get("model") or model
+    print(f"  - 注册智能体: {agent_cfg['name']} ({model})")
+    if agent_cfg.get("memory_backend"):
+        memory_sys.collection_backends.setdefault(agent_cfg["collection_name"], agent_cfg["memory_backend"])
+    return GenericAgent(
+        name=agent_cfg['name'],
+        description=agent_cfg['description'],
+        system_prompt=agent_cfg['system_prompt'],
+        collection_name=agent_cfg['collection_name'],
+        allowed_tools=agent_cfg.get("allowed_tools", []),
+        model=model,
+        mcp_client=mcp_client,
+        memory_sys=memory_sys,
+        stream=agent_cfg.get("stream"),
+        context=agent_cfg.get("context"),
+        response_cache=agent_cfg.get("response_cache"),
+        retrieval=agent_cfg.get("retrieval"),
+        tool_loop=agent_cfg.get("tool_loop")
+    )
+
+def build_agents(config, mcp_client, memory_sys):
+    model = default_model(config)
+    return {agent_cfg['name']: build_agent(agent_cfg, mcp_client, memory_sys, model)
+            for agent_cfg in config.get("agents", [])}
+
+def build_model_manager(config):
+    """模型预热与 keep_alive 续期 (agents.yaml 的 models 段)"""
+    models_cfg = dict(config.get("models", {}))
+    models_cfg.pop("default", None)
+    preload = models_cfg.pop("preload", True)
+    manager = ModelManager(llm.get_client(), **models_cfg)
+    if preload:
+        manager.preload(configured_models(config), background=True)
+    manager.start()
+    return manager
+
+def build_reloader(config, agents, orchestrator, mcp_client, memory_sys, model_manager=None):
+    """配置热重载：只重建新增或变更的智能体，编排器原子替换"""
+    model = default_model(config)
+
+    def apply_config(old_config, new_config):
+        if old_config.get("tracing") != new_config.get("tracing"):
+            tracing.configure(**new_config.get("tracing", {}))
+        # 新增或改用的模型立即预热
+        new_models = set(configured_models(new_config)) - set(configured_models(old_config))
+        if model_manager and new_models:
+            model_manager.preload(sorted(new_models), background=True)
+
+    return HotReloader(
+        CONFIG_PATH, config, agents, orchestrator,
+        build_agent=lambda agent_cfg: build_agent(agent_cfg, mcp_client, memory_sys, model),
+        build_orchestrator=lambda new_config, new_agents: build_orchestrator(new_config, new_agents, memory_sys, model),
+        interval=config.get("runtime", {}).get("reload_interval", 2),
+        on_config=apply_config
+    )
+
+def build_router(config, memory_sys):
+    """按 manager.router 配置构建嵌入路由 (描述 + examples 示例语句)"""
+    router_cfg = dict(config.get("manager", {}).get("router") or {})
+    if not router_cfg.pop("enabled", False):
+        return None
+    routes = {cfg["name"]: [cfg["description"]] + list(cfg.get("examples") or []) for cfg in config.get("agents", [])}
+    return EmbeddingRouter(memory_sys.embed, routes, **router_cfg)
+
+def build_orchestrator(config, agents, memory_sys, model=None):
+    manager_cfg = config.get("manager", {})
+    return Orchestrator(agents, model=manager_cfg.get("model") or model or default_model(config),
+                        context=manager_cfg.get("context"), router=build_router(config, memory_sys))
+
+def print_stats(agents, orchestrator, reloader=None):
+    r = orchestrator.routing_metrics()
+    print(f"  [Manager] 请求 {r['requests']}，快速路由 {r['fast_path']} (绕过 LLM {r['bypass_rate']:.0%}，"
+          f"平均 {r['fast_avg_ms']:.0f} ms)，LLM 路由 {r['llm']} (平均 {r['llm_avg_ms']:.0f} ms)")
+    for name, agent in agents.items():
+        m = agent.metrics
+        print(f"  [{name}] 请求 {m['requests']}，提示 tokens 估算 {m['prompt_tokens_est']} (节省 {m['prompt_tokens_saved']})，"
+              f"检索注入 {m['rag_tokens_injected']} tokens (过滤 {m['rag_tokens_saved']})")
+        if m["tool_steps"]:
+            print(f"      工具循环: {m['tool_steps']} 步 / {m['tool_calls']} 次调用，"
+                  f"平均每步工具耗时 {m['tool_seconds'] / m['tool_steps'] * 1000:.0f} ms，触达上限 {m['tool_loop_cutoffs']} 次")
+        if agent.response_cache:
+            c = agent.response_cache.metrics()
+            print(f"      语义缓存: 命中率 {c['hit_rate']:.0%} ({c['hits']}/{c['lookups']})，条目 {c['size']}，"
+                  f"节省生成时间 {c['latency_saved']:.1f}s，失效 {c['invalidations']}，过期 {c['expirations']}，淘汰 {c['evictions']}")
+    if orchestrator.llm.models:
+        mm = orchestrator.llm.models.metrics()
+        resident = ", ".join(mm["resident"]) if mm["resident"] is not None else "未知"
+        print(f"  [Models] 常驻: {resident}；冷启动 {mm['cold_starts']} 次 (占请求 {mm['cold_start_rate']:.0%})")
+        for name, entry in mm["models"].items():
+            print(f"      {name}: 请求 {entry['requests']}，冷路由 {entry['cold_routes']}，冷启动 {entry['cold_starts']} "
+                  f"(加载耗时 {entry['load_seconds']:.1f}s)，预热/续期 {entry['warmups']} 次")
+    memory_sys = next((agent.memory_sys for agent in agents.values() if agent.memory_sys), None)
+    if memory_sys and memory_sys.engine.stats["batches"]:
+        e = memory_sys.engine.metrics()
+        print(f"  [Embedding] 后端 {memory_sys.embedding_backend}，{e['requests']} 个请求合并为 {e['batches']} 批 "
+              f"(平均每批 {e['avg_batch']:.1f} 条)，延迟 p50 {e['latency']['p50'] * 1000:.1f} ms / "
+              f"p95 {e['latency']['p95'] * 1000:.1f} ms")
+    mcp_client = next((agent.mcp_client for agent in agents.values() if agent.mcp_client), None)
+    if mcp_client:
+        for w in mcp_client.metrics()["workers"]:
+            print(f"  [MCP #{w['index']}] pid {w['pid']}{'' if w['alive'] else ' (已退出)'}，在途 {w['outstanding']}，"
+                  f"调用 {w['calls']} (失败 {w['errors']})，利用率 {w['utilization']:.0%}，重启 {w['restarts']} 次")
+        cache = mcp_client.extract_cache_stats()
+        if cache:
+            print(f"  [MCP] 提取缓存: 命中率 {cache['hit_rate']:.0%} ({cache['hits']}/{cache['hits'] + cache['misses']})，"
+                  f"条目 {cache['entries']}，占用 {cache['disk_bytes'] / 1e6:.1f} MB，节省解析时间 {cache['seconds_saved']:.1f}s")
+    if reloader and reloader.stats["reloads"]:
+        rl = reloader.metrics()
+        print(f"  [Reload] 重载 {rl['reloads']} 次 (失败 {rl['failures']})，最近一次 {rl['last_seconds'] * 1000:.0f} ms，"
+              f"累计重建 {rl['agents_rebuilt']} 个智能体、保留 {rl['agents_kept']} 个")
+    spans = tracing.get_tracer().snapshot()
+    if spans:
+        print("  [Tracing] 各阶段耗时:")
+        for name, span in sorted(spans.items()):
+            print(f"      {name}: {span['count']} 次，平均 {span['sum_seconds'] / span['count'] * 1000:.1f} ms")
+
+def run_server(config, reloader):
+    """服务模式：多会话 HTTP 接口，智能体 / 记忆 / MCP 在会话间共享"""
+    server_cfg = dict(config.get("server", {}))
+    sessions = SessionStore(
+        path=server_cfg.pop("session_path", "./sessions"),
+        idle_seconds=server_cfg.pop("idle_seconds", 900),
+        max_sessions=server_cfg.pop("max_sessions", 1000)
+    )
+    try:
+        asyncio.run(serve(reloader.orchestrator, sessions, reloader=reloader, **server_cfg))
+    except KeyboardInterrupt:
+        print("\n服务已停止，活跃会话已写入磁盘。")
+
 def main():
+    parser = argparse.ArgumentParser(description="MyAgent Framework Kernel")
+    parser.add_argument("--serve", action="store_true", help="以多会话 HTTP 服务模式运行 (配置见 agents.yaml 的 server 段)")
+    parser.add_argument("--host", help="覆盖 server.host")
+    parser.add_argument("--port", type=int, help="覆盖 server.port")
+    parser.add_argument("--batch", metavar="INPUT", help="批量处理 JSONL 请求文件 (每行一个请求)")
+    parser.add_argument("--output", help="批量结果输出文件 (默认 <INPUT>.results.jsonl，同时作为断点续跑的检查点)")
+    parser.add_argument("--concurrency", type=int, default=8, help="批量处理的并发请求数")
+    parser.add_argument("--field", help="请求中消息所在的字段 (默认依次尝试 message / prompt / input / question / body)")
+    args = parser.parse_args()
+
     print("=== MyAgent Framework Kernel ===")
     print("正在加载核心模块...")
+    started_at = time.perf_counter()
+    config = load_config()
+    runtime_cfg = config.get("runtime", {})
+    lazy = runtime_cfg.get("lazy_init", True)
     
-    # 1. 初始化基础设施
-    memory_sys = MemorySystem()
+    # 1. 初始化基础设施 (lazy 模式下重量级组件推迟到首次使用)
+    memory_sys = MemorySystem(lazy=lazy, **memory_options(config))
     # 指向 core/server.py
     server_path = os.path.join("core", "server.py")
-    mcp_client = MCPClient(server_path)
+    mcp_client = MCPClient(server_path, lazy=lazy, **config.get("mcp", {}))
+    if lazy and runtime_cfg.get("background_warmup", True):
+        # REPL 接受输入的同时在后台预热
+        memory_sys.warmup(background=True)
+        mcp_client.start(background=True)
     
     # 2. 加载智能体配置 (Profiles)
     print("正在加载智能体配置...")
-    config = load_config()
-    agents_config = config.get("agents", [])
-    
+    llm.configure(**config.get("llm", {}))
+    tracing.configure(**config.get("tracing", {}))
+    model_manager = build_model_manager(config)
+
     # 3. 动态实例化智能体
-    agents = {}
-    for agent_cfg in agents_config:
-        print(f"  - 注册智能体: {agent_cfg['name']}")
-        agents[agent_cfg['name']] = GenericAgent(
-            name=agent_cfg['name'],
-            description=agent_cfg['description'],
-            system_prompt=agent_cfg['system_prompt'],
-            collection_name=agent_cfg['collection_name'],
-            allowed_tools=agent_cfg.get("allowed_tools", []),
-            mcp_client=mcp_client,
-            memory_sys=memory_sys
-        )
+    agents = build_agents(config, mcp_client, memory_sys)
         
     # 4. 启动编排器
-    print(f"✅ 系统就绪，共加载 {len(agents)} 个智能体。")
-    orchestrator = Orchestrator(agents)
+    print(f"✅ 系统就绪，共加载 {len(agents)} 个智能体 (启动耗时 {time.perf_counter() - started_at:.2f}s)。")
+    orchestrator = build_orchestrator(config, agents, memory_sys)
+
+    if args.batch:
+        output = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+        runner = BatchRunner(orchestrator, concurrency=args.concurrency, field=args.field)
+        try:
+            print_report(asyncio.run(runner.run(args.batch, output)))
+            print(f"   结果已写入 {output}")
+        finally:
+            mcp_client.close()
+            tracing.get_tracer().close()
+        return
+
+    reloader = build_reloader(config, agents, orchestrator, mcp_client, memory_sys, model_manager)
+    if runtime_cfg.get("hot_reload", True):
+        reloader.start()
+
+    if args.serve:
+        server_cfg = dict(config.get("server", {}))
+        if args.host: server_cfg["host"] = args.host
+        if args.port: server_cfg["port"] = args.port
+        try:
+            run_server(dict(config, server=server_cfg), reloader)
+        finally:
+            mcp_client.close()
+            tracing.get_tracer().close()
+        return
     
     print("-" * 50)
-    print("交互已就绪。输入 'reload' 可重新加载配置。")
+    print("交互已就绪。输入 'reload' 可重新加载配置，'stats' 查看运行指标。")
     
     try:
         while True:
@@ -52,30 +231,21 @@ def main():
             if not user_input: continue
             if user_input.lower() in ["exit", "quit"]: break
             
-            # 支持热重载配置 (Growth Capability)
+            # 支持热重载配置 (Growth Capability)：文件修改后自动生效，也可手动触发
             if user_input.lower() == "reload":
                 print("正在重载配置...")
-                config = load_config()
-                # 简单重载逻辑：清空并重新注册 (实际生产应更平滑)
-                agents.clear()
-                for agent_cfg in config.get("agents", []):
-                    agents[agent_cfg['name']] = GenericAgent(
-                        name=agent_cfg['name'],
-                        description=agent_cfg['description'],
-                        system_prompt=agent_cfg['system_prompt'],
-                        collection_name=agent_cfg['collection_name'],
-                        allowed_tools=agent_cfg.get("allowed_tools", []),
-                        mcp_client=mcp_client,
-                        memory_sys=memory_sys
-                    )
-                orchestrator = Orchestrator(agents)
-                print("配置已更新。")
+                reloader.reload()
+                continue
+
+            if user_input.lower() == "stats":
+                print_stats(reloader.agents, reloader.orchestrator, reloader)
                 continue
             
-            orchestrator.process(user_input)
+            reloader.orchestrator.process(user_input)
             
     finally:
         mcp_client.close()
+        tracing.get_tracer().close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.llm import LLMClient
+from scripts.ollama_stub import start_stub
+
+# === LLM 客户端基准：裸 requests.post vs 连接池 + asyncio ===
+
+def make_payload(i):
+    return {"model": "stub", "messages": [{"role": "user", "content": f"ping {i}"}], "stream": False}
+
+def bench_bare(url, n):
+    start = time.perf_counter()
+    for i in range(n):
+        requests.post(f"{url}/api/chat", json=make_payload(i)).json()
+    return time.perf_counter() - start
+
+async def bench_pooled(url, n, concurrency):
+    client = LLMClient(base_url=url, pool_size=concurrency)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await client.chat(make_payload(i))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server, url = start_stub(latency=args.latency)
+    try:
+        bare = bench_bare(url, args.requests)
+        pooled = asyncio.run(bench_pooled(url, args.requests, args.concurrency))
+    finally:
+        server.shutdown()
+
+    print(f"requests={args.requests} latency={args.latency}s concurrency={args.concurrency}")
+    print(f"  bare requests.post : {args.requests / bare:8.1f} req/s ({bare:.2f}s)")
+    print(f"  pooled async client: {args.requests / pooled:8.1f} req/s ({pooled:.2f}s)")
+    print(f"  speedup            : {bare / pooled:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# === 启动基准 ===
+# 每一项都在全新的子进程中测量，保证导入是冷启动
+
+IMPORTS = ["yaml", "requests", "core.llm", "core.memory", "core.mcp", "core.agent",
+           "core.orchestrator", "chromadb", "sentence_transformers", "pypdf", "docx"]
+
+IMPORT_SNIPPET = """
+import json, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+"""
+
+COMPONENT_SNIPPETS = {
+    "memory.chroma_client": """
+import json, time
+from core.memory import MemorySystem
+m = MemorySystem(lazy=True)
+start = time.perf_counter()
+m.client
+print(json.dumps({"seconds": time.perf_counter() - start, "detail": m.startup_timings}))
+""",
+    "memory.embedding_model": """
+import json, time
+from core.memory import MemorySystem
+m = MemorySystem(lazy=True)
+start = time.perf_counter()
+m.embedding_model
+print(json.dumps({"seconds": time.perf_counter() - start, "detail": m.startup_timings}))
+""",
+    "mcp.server": """
+import json, time
+from core.mcp import MCPClient
+start = time.perf_counter()
+c = MCPClient("core/server.py")
+print(json.dumps({"seconds": time.perf_counter() - start}))
+c.close()
+""",
+    "kernel.eager": """
+import json, time
+start = time.perf_counter()
+import main
+from core.memory import MemorySystem
+from core.mcp import MCPClient
+from core.orchestrator import Orchestrator
+config = main.load_config()
+m = MemorySystem(lazy=False)
+c = MCPClient("core/server.py", lazy=False)
+agents = main.build_agents(config, c, m)
+Orchestrator(agents)
+print(json.dumps({"seconds": time.perf_counter() - start}))
+c.close()
+""",
+    "kernel.lazy": """
+import json, time
+start = time.perf_counter()
+import main
+from core.memory import MemorySystem
+from core.mcp import MCPClient
+from core.orchestrator import Orchestrator
+config = main.load_config()
+m = MemorySystem(lazy=True)
+c = MCPClient("core/server.py", lazy=True)
+agents = main.build_agents(config, c, m)
+Orchestrator(agents)
+print(json.dumps({"seconds": time.perf_counter() - start}))
+c.close()
+"""
+}
+
+def run_snippet(code):
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        error = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+        return {"error": error}
+    return json.loads(lines[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="测量模块导入耗时与各组件就绪耗时")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = {"imports": {}, "components": {}}
+    for module in IMPORTS:
+        results["imports"][module] = run_snippet(IMPORT_SNIPPET.format(module=module))
+    for name, code in COMPONENT_SNIPPETS.items():
+        results["components"][name] = run_snippet(code)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+        return
+    for section, entries in results.items():
+        print(f"[{section}]")
+        for name, result in entries.items():
+            if "error" in result:
+                print(f"  {name:<26} 失败: {result['error']}")
+            else:
+                print(f"  {name:<26} {result['seconds'] * 1000:9.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core.agent import GenericAgent
+from core.llm import LLMClient
+from core.mcp import MCPClient
+from core.memory import MemorySystem
+from core.orchestrator import Orchestrator
+from core.router import EmbeddingRouter
+from core.session import Session
+from scripts.ollama_stub import start_stub
+
+# === 离线基准套件 ===
+# 用本地 Ollama 替身 + 合成文档测量内核自身的开销 (路由 / RAG / 工具 / MCP / 记忆)，
+# 不需要 GPU 或真实模型；结果以 JSON 输出，便于跟踪回归
+
+WORDS = ("agent memory vector tool router context stream chunk python course lesson model "
+         "embedding query prompt token latency cache server session batch document folder").split()
+
+class HashEmbedder:
+    """确定性的词袋哈希嵌入，用来代替 SentenceTransformer (--embedder hash)"""
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors /= norms
+        return vectors[0] if single else vectors
+
+def synthetic_text(rng, words):
+    return " ".join(rng.choice(WORDS, size=words))
+
+def summarize(samples, **extra):
+    samples = sorted(samples)
+    result = {"n": len(samples)}
+    if samples:
+        result.update({
+            "mean_ms": sum(samples) / len(samples) * 1000,
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+        })
+    result.update(extra)
+    return result
+
+async def timed(coro_factory, n):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        await coro_factory(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def make_memory(workdir, args):
+    memory_sys = MemorySystem(
+        persist_path=os.path.join(workdir, "chroma_db"),
+        model_name="bench-hash" if args.embedder == "hash" else "all-MiniLM-L6-v2",
+        lazy=True,
+        backend=args.backend,
+        vector_store_path=os.path.join(workdir, "vector_store")
+    )
+    if args.embedder == "hash":
+        memory_sys._embedding_model = HashEmbedder()
+    return memory_sys
+
+def bench_llm(server, url, args):
+    """LLM 客户端开销：请求耗时减去替身的模拟延迟"""
+    client = LLMClient(base_url=url)
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "ping"}]}
+
+    async def run():
+        results = {}
+        for stream in (False, True):
+            async def one(i):
+                async for _ in client.chat_events(dict(payload, stream=stream)):
+                    pass
+            samples = await timed(one, args.requests)
+            results["stream" if stream else "non_stream"] = summarize(
+                [s - server.latency for s in samples], stub_latency_ms=server.latency * 1000)
+        return results
+
+    try:
+        return asyncio.run(run())
+    finally:
+        client.close()
+
+def bench_memory(memory_sys, args):
+    rng = np.random.default_rng(args.seed)
+    chunks = [synthetic_text(rng, 60) + f" #{i}" for i in range(args.chunks)]
+    start = time.perf_counter()
+    written = memory_sys.add_memories(chunks, {"agent": "bench"}, collection_name="bench_memory")
+    ingest_seconds = time.perf_counter() - start
+    # 再次写入相同内容：全部命中去重，测量跳过路径
+    start = time.perf_counter()
+    memory_sys.add_memories(chunks, {"agent": "bench"}, collection_name="bench_memory")
+    dedupe_seconds = time.perf_counter() - start
+
+    queries = [synthetic_text(rng, 8) for _ in range(args.requests)]
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        memory_sys.search(query, n_results=5, collection_name="bench_memory")
+        samples.append(time.perf_counter() - start)
+
+    # 并发编码 (未命中缓存的新语句)：观察嵌入引擎的合批效果
+    fresh = [synthetic_text(rng, 8) + f" concurrent #{i}" for i in range(args.requests)]
+    batches_before = memory_sys.engine.stats["batches"]
+
+    def embed_one(text):
+        start = time.perf_counter()
+        memory_sys.embed(text)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        concurrent_samples = list(pool.map(embed_one, fresh))
+    batches = memory_sys.engine.stats["batches"] - batches_before
+    return {
+        "ingest": {"chunks": len(chunks), "written": written, "seconds": ingest_seconds,
+                   "chunks_per_sec": len(chunks) / ingest_seconds if ingest_seconds else None},
+        "dedupe": {"chunks": len(chunks), "seconds": dedupe_seconds},
+        "query": summarize(samples),
+        "concurrent_embed": summarize(concurrent_samples, batches=batches,
+                                      avg_batch=len(fresh) / batches if batches else None)
+    }
+
+def bench_agent(server, url, memory_sys, args):
+    """单个智能体：纯生成、带 RAG、一轮 query_memory 工具调用"""
+    client = LLMClient(base_url=url)
+    results = {}
+
+    def agent(collection):
+        return GenericAgent("BenchAgent", "bench", "You are a benchmark agent.", collection,
+                            memory_sys=memory_sys, llm_client=client, stream=args.stream)
+
+    async def run(name, collection, tool_calls=None, llm_calls=1, tool_steps=1, parallel_tools=False):
+        server.tool_calls = tool_calls or {}
+        server.tool_steps, server.parallel_tools = tool_steps, parallel_tools
+        bench_agent_ = agent(collection)
+        samples = await timed(lambda i: bench_agent_.achat(f"question {i} about agent memory"), args.requests)
+        results[name] = summarize([s - server.latency * llm_calls for s in samples], llm_calls=llm_calls)
+
+    try:
+        asyncio.run(run("plain", "bench_empty"))
+        asyncio.run(run("rag", "bench_memory"))
+        asyncio.run(run("tool_query_memory", "bench_memory", {"query_memory": {"query": "agent memory"}}, llm_calls=2))
+        # 两步工具循环，每步并行两个工具
+        asyncio.run(run("tool_loop_parallel", "bench_memory",
+                        {"query_memory": {"query": "agent memory"}, "save_memory": {"content": "bench note"}},
+                        llm_calls=3, tool_steps=2, parallel_tools=True))
+    finally:
+        server.tool_calls = {}
+        server.tool_steps, server.parallel_tools = 1, False
+        client.close()
+    return results
+
+def bench_orchestrator(server, url, memory_sys, args):
+    """路由：嵌入快速路径 vs Manager LLM 派发 (dispatch_task 工具调用)"""
+    client = LLMClient(base_url=url)
+    agents = {
+        name: GenericAgent(name, description, f"You are {name}.", f"bench_{name.lower()}",
+                           memory_sys=memory_sys, llm_client=client, stream=args.stream)
+        for name, description in (("Tutor", "course lesson agent memory"),
+                                  ("Coder", "python code tool server"),
+                                  ("Chat", "hello chat session"))
+    }
+    routes = {name: [agent.description] for name, agent in agents.items()}
+    results = {}
+
+    async def run(name, router, tool_calls, llm_calls, text):
+        server.tool_calls = tool_calls
+        orchestrator = Orchestrator(agents, llm_client=client, stream=args.stream, router=router)
+        samples = await timed(lambda i: orchestrator.aprocess(text), args.requests)
+        results[name] = summarize([s - server.latency * llm_calls for s in samples], llm_calls=llm_calls,
+                                  routing=orchestrator.routing_metrics())
+
+    async def semantic_cache():
+        """经 Manager 派发的请求也查语义缓存；追问只命中此前发言相同的对话"""
+        server.tool_calls = {"dispatch_task": {"agent_name": "Tutor", "task_description": "bench"}}
+        tutor = GenericAgent("Tutor", "course lesson agent memory", "You are Tutor.", "bench_cache",
+                             memory_sys=memory_sys, llm_client=client, stream=args.stream,
+                             response_cache={"threshold": 0.9})
+        orchestrator = Orchestrator(dict(agents, Tutor=tutor), llm_client=client, stream=args.stream)
+        a, b, c = Session("cache-a"), Session("cache-b"), Session("cache-c")
+        script = [(a, "what is agent memory"), (b, "what is agent memory"),  # 第二个会话的首轮命中
+                  (a, "继续"), (b, "继续"),                                    # 上下文相同的追问命中
+                  (c, "explain the python tool server"), (c, "继续")]          # 上下文不同的追问不能命中
+        hits = []
+        for session, text in script:
+            before = tutor.response_cache.stats["hits"]
+            await orchestrator.aprocess(text, session)
+            hits.append(tutor.response_cache.stats["hits"] > before)
+        expected = [False, True, False, True, False, False]
+        if hits != expected:
+            raise AssertionError(f"语义缓存命中序列 {hits}，预期 {expected}")
+        results["semantic_cache"] = tutor.response_cache.metrics()
+
+    dispatch = {"dispatch_task": {"agent_name": "Coder", "task_description": "bench"}}
+    try:
+        asyncio.run(run("llm_dispatch", None, dispatch, 2, "python code please"))
+        asyncio.run(run("fast_path", EmbeddingRouter(memory_sys.embed, routes, min_score=0.3, margin=0.05),
+                        dispatch, 1, "python code tool server"))
+        asyncio.run(semantic_cache())
+    finally:
+        server.tool_calls = {}
+        client.close()
+    return results
+
+def bench_mcp(workdir, args):
+    """MCP：冷启动、read_document 往返、read_folder 流式读取吞吐"""
+    rng = np.random.default_rng(args.seed)
+    docs = os.path.join(workdir, "docs")
+    os.makedirs(docs)
+    for i in range(args.documents):
+        with open(os.path.join(docs, f"doc_{i:03d}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Document {i}\n\n" + "\n\n".join(synthetic_text(rng, 80) for _ in range(args.paragraphs)))
+
+    start = time.perf_counter()
+    client = MCPClient(os.path.join(ROOT, "core", "server.py"))
+    startup = time.perf_counter() - start
+    try:
+        async def roundtrips():
+            return await timed(lambda i: client.acall_tool("read_document",
+                                                           {"path": os.path.join(docs, f"doc_{i % args.documents:03d}.md")}),
+                               args.requests)
+        samples = asyncio.run(roundtrips())
+
+        start = time.perf_counter()
+        frames = chars = 0
+        for frame in client.call_tool_stream("read_folder", {"path": docs}):
+            frames += 1
+            chars += len(frame["text"])
+        stream_seconds = time.perf_counter() - start
+    finally:
+        client.close()
+    return {
+        "startup_seconds": startup,
+        "read_document": summarize(samples),
+        "read_folder_stream": {"documents": args.documents, "frames": frames, "chars": chars,
+                               "seconds": stream_seconds,
+                               "mb_per_sec": chars / stream_seconds / 1e6 if stream_seconds else None}
+    }
+
+SUITES = ("llm", "memory", "agent", "orchestrator", "mcp")
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准套件 (本地 Ollama 替身 + 合成数据)")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"要运行的项目，逗号分隔: {', '.join(SUITES)}")
+    parser.add_argument("--requests", type=int, default=50, help="每项测量的请求数")
+    parser.add_argument("--latency", type=float, default=0.01, help="替身的模拟生成延迟 (秒)，结果中已扣除")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true", help="智能体与 Manager 使用流式调用")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--embedder", default="hash", choices=["hash", "model"],
+                        help="hash: 确定性哈希嵌入 (无需模型)；model: 真实 SentenceTransformer")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="把 JSON 结果写入文件 (默认输出到标准输出)")
+    parser.add_argument("--verbose", action="store_true", help="保留智能体的运行日志")
+    args = parser.parse_args()
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="uark_bench_")
+    server, url = start_stub(latency=args.latency, token_delay=args.token_delay)
+    memory_sys = make_memory(workdir, args)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args)
+        },
+        "results": {}
+    }
+    # 智能体会逐 token 打印，测量时默认屏蔽
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            if "llm" in suites:
+                report["results"]["llm"] = bench_llm(server, url, args)
+            if "memory" in suites or "agent" in suites:
+                report["results"]["memory"] = bench_memory(memory_sys, args)
+            if "agent" in suites:
+                report["results"]["agent"] = bench_agent(server, url, memory_sys, args)
+            if "orchestrator" in suites:
+                report["results"]["orchestrator"] = bench_orchestrator(server, url, memory_sys, args)
+            if "mcp" in suites:
+                report["results"]["mcp"] = bench_mcp(workdir, args)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    data = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+        print(f"结果已写入 {args.output}")
+    else:
+        print(data)
+
+if __name__ == "__main__":
+    main()
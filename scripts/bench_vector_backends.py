@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.vector_store import ChromaStore, NumpyStore
+
+# === 向量存储后端基准：ChromaDB vs NumPy 内存映射 ===
+# 使用固定随机种子生成的合成 384 维语料，不需要嵌入模型
+# numpy 后端可带量化方式，例如 --backends numpy,numpy:float16,numpy:int8,chroma
+
+def make_corpus(n, dim, seed=42, clusters=64):
+    """带簇结构的单位向量，比纯随机更接近真实句向量的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+def open_store(backend, path, rerank_factor=4):
+    if backend.startswith("numpy"):
+        quantization = backend.partition(":")[2] or None
+        return NumpyStore(os.path.join(path, "bench"), quantization=quantization, rerank_factor=rerank_factor)
+    import chromadb
+    return ChromaStore(chromadb.PersistentClient(path=path), "bench")
+
+def scan_bytes(store):
+    """全量扫描需要读取的矩阵大小 (即检索时的常驻内存)"""
+    if not isinstance(store, NumpyStore):
+        return None
+    if not store.quantization:
+        return os.path.getsize(store._vectors_path)
+    size = os.path.getsize(store._codes_path)
+    if store.quantization == "int8":
+        size += os.path.getsize(store._scales_path)
+    return size
+
+def bench_backend(backend, vectors, queries, k, batch_size, rerank_factor):
+    path = tempfile.mkdtemp(prefix=f"bench_{backend.replace(':', '_')}_")
+    try:
+        store = open_store(backend, path, rerank_factor)
+        ids = [f"doc-{i}" for i in range(len(vectors))]
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch_size):
+            store.upsert(
+                ids=ids[i:i+batch_size],
+                embeddings=vectors[i:i+batch_size].tolist(),
+                documents=[f"document {j}" for j in range(i, min(i + batch_size, len(vectors)))],
+                metadatas=[{"agent": "bench", "n": j} for j in range(i, min(i + batch_size, len(vectors)))]
+            )
+        store.persist()
+        insert_seconds = time.perf_counter() - start
+        del store
+
+        # 冷启动：重新打开已有数据
+        start = time.perf_counter()
+        store = open_store(backend, path, rerank_factor)
+        store.count()
+        open_seconds = time.perf_counter() - start
+
+        latencies = []
+        hits = []
+        for q in queries:
+            start = time.perf_counter()
+            result = store.query(q.tolist(), k)
+            latencies.append(time.perf_counter() - start)
+            hits.append([int(h["id"].split("-")[1]) for h in result])
+        latencies.sort()
+        return {
+            "insert_seconds": insert_seconds,
+            "insert_per_sec": len(vectors) / insert_seconds,
+            "open_seconds": open_seconds,
+            "query_p50_ms": latencies[len(latencies) // 2] * 1000,
+            "query_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+            "disk_bytes": dir_size(path),
+            "scan_bytes": scan_bytes(store),
+            "hits": hits
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def recall_at_k(hits, truth):
+    return float(np.mean([len(set(h) & set(t)) / len(t) for h, t in zip(hits, truth)]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--backends", default="numpy,numpy:float16,numpy:int8,chroma")
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    vectors = make_corpus(args.size, args.dim)
+    queries = make_corpus(args.queries, args.dim, seed=7)
+    # 全精度精确检索作为 recall 的基准
+    truth = [list(np.argsort(-(vectors @ q))[:args.k]) for q in queries]
+
+    results = {}
+    for backend in args.backends.split(","):
+        try:
+            result = bench_backend(backend, vectors, queries, args.k, args.batch_size, args.rerank_factor)
+        except ImportError as e:
+            results[backend] = {"error": str(e)}
+            continue
+        result["recall_at_k"] = recall_at_k(result.pop("hits"), truth)
+        results[backend] = result
+
+    if args.json:
+        print(json.dumps({"size": args.size, "dim": args.dim, "k": args.k, "results": results}, indent=2))
+        return
+    print(f"size={args.size} dim={args.dim} queries={args.queries} k={args.k} rerank_factor={args.rerank_factor}")
+    for backend, r in results.items():
+        if "error" in r:
+            print(f"  {backend:<13} 跳过: {r['error']}")
+            continue
+        scan = f"{r['scan_bytes'] / 1e6:6.1f} MB" if r["scan_bytes"] is not None else "     -   "
+        print(f"  {backend:<13} insert {r['insert_per_sec']:9.0f}/s  open {r['open_seconds'] * 1000:7.1f} ms  "
+              f"query p50 {r['query_p50_ms']:6.2f} ms  p95 {r['query_p95_ms']:6.2f} ms  "
+              f"recall@{args.k} {r['recall_at_k']:.3f}  disk {r['disk_bytes'] / 1e6:6.1f} MB  scan {scan}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from core.memory import MemorySystem, memory_options
+
+# === 记忆集合去重 ===
+# 把旧版本用随机 uuid 写入的切片迁移为内容寻址 id，并删除重复副本。
+# 存储后端 (chroma / numpy、量化、目录) 与运行时一致，读取 agents.yaml 的 memory 段与各智能体的 memory_backend
+
+def main():
+    parser = argparse.ArgumentParser(description="按内容哈希对记忆集合去重 (原地)")
+    parser.add_argument("collections", nargs="*", help="要压缩的集合名，默认处理全部集合")
+    parser.add_argument("--config", default=os.path.join(ROOT, "config", "agents.yaml"))
+    parser.add_argument("--persist-path", help="覆盖 memory.persist_path")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    options = memory_options(config)
+    if args.persist_path:
+        options["persist_path"] = args.persist_path
+    memory_sys = MemorySystem(lazy=True, **options)
+
+    if args.collections:
+        targets = [(name, memory_sys.backend_of(name)) for name in args.collections]
+    else:
+        targets = []
+        for name, backend in memory_sys.list_collections():
+            if backend != memory_sys.backend_of(name):
+                # 运行时不会读取这份数据 (例如迁移后留下的旧库)，不在这里改动
+                print(f"  ⏭️ {name}: 位于 {backend} 后端，但配置使用 {memory_sys.backend_of(name)}，跳过")
+                continue
+            targets.append((name, backend))
+
+    for name, backend in targets:
+        stats = memory_sys.compact_collection(name)
+        print(f"  🧹 {name} [{backend}]: {stats['before']} -> {stats['after']} (移除重复 {stats['removed']})")
+
+if __name__ == "__main__":
+    main()
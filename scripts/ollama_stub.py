@@ -0,0 +1,199 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === 本地 Ollama 替身 ===
+# 模拟 /api/chat 协议，用于在没有 GPU / 真实模型的情况下测量内核自身的开销；
+# 另外模拟模型加载：未常驻的模型首个请求额外等待 load_time，并在 keep_alive 到期后"卸载"
+
+def _keep_alive_seconds(value, default=300):
+    """Ollama 的 keep_alive："30m" / "10s" / 秒数；负数表示永久常驻"""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出，不关闭 Nagle 会叠加约 40ms 的延迟确认
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _load(self, payload):
+        """按需"加载"模型并按 keep_alive 续期，返回本次的 load_duration (纳秒)"""
+        model = payload.get("model", "stub")
+        now = time.time()
+        with self.server.lock:
+            expires = self.server.resident.get(model)
+            cold = expires is None or (expires >= 0 and expires < now)
+            self.server.loads += cold
+        if cold:
+            time.sleep(self.server.load_time)
+        ttl = _keep_alive_seconds(payload.get("keep_alive"))
+        with self.server.lock:
+            self.server.resident[model] = -1 if ttl < 0 else time.time() + ttl
+        return int(self.server.load_time * 1e9) if cold else 0
+
+    def do_GET(self):
+        if self.path != "/api/ps":
+            self.send_error(404)
+            return
+        now = time.time()
+        with self.server.lock:
+            models = [{"name": name, "model": name, "expires_at": expires}
+                      for name, expires in self.server.resident.items() if expires < 0 or expires >= now]
+        self._send_json({"models": models})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/generate":
+            # 不带 prompt 的 generate 只加载模型
+            load_duration = self._load(payload)
+            self._send_json({"model": payload.get("model", "stub"), "response": "", "done": True,
+                             "load_duration": load_duration})
+            return
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+
+        load_duration = self._load(payload)
+        time.sleep(self.server.latency)
+        messages = payload.get("messages", [])
+        stats = {
+            "prompt_eval_count": sum(len(str(m.get("content", ""))) for m in messages) // 4,
+            "eval_count": len(self.server.reply) // 4,
+            "load_duration": load_duration
+        }
+        tool_calls = self._pick_tool_calls(payload)
+        if payload.get("stream"):
+            try:
+                self._stream_reply(payload, stats, tool_calls)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # 客户端提前关闭了流
+            return
+
+        message = {"role": "assistant", "content": "" if tool_calls else self.server.reply}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        self._send_json(dict({
+            "model": payload.get("model", "stub"),
+            "message": message,
+            "done": True
+        }, **stats))
+
+    def _pick_tool_calls(self, payload):
+        """请求携带了已配置的工具、且本轮已完成的工具步数少于 tool_steps 时，返回预设的工具调用
+
+        parallel_tools 为真时一次返回所有可用的预设工具，否则只返回第一个。
+        """
+        messages = payload.get("messages") or []
+        if not self.server.tool_calls:
+            return None
+        steps = 0
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                break
+            if message.get("tool_calls"):
+                steps += 1
+        if steps >= self.server.tool_steps:
+            return None
+        offered = [t.get("function", {}).get("name") for t in payload.get("tools") or []]
+        calls = [{"function": {"name": name, "arguments": self.server.tool_calls[name]}}
+                 for name in offered if name in self.server.tool_calls]
+        if not calls:
+            return None
+        return calls if self.server.parallel_tools else calls[:1]
+
+    def _write_chunk(self, obj):
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_reply(self, payload, stats, tool_calls=None):
+        # NDJSON 分块输出，与 Ollama 的 stream=true 行为一致
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        model = payload.get("model", "stub")
+        if tool_calls:
+            # Ollama 在一个独立的块中给出完整的 tool_calls
+            self._write_chunk({"model": model, "message": {"role": "assistant", "content": "", "tool_calls": tool_calls},
+                               "done": False})
+            self._write_chunk(dict({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}, **stats))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            return
+        for i, word in enumerate(self.server.reply.split(" ")):
+            if i:
+                time.sleep(self.server.token_delay)
+            token = word if i == 0 else " " + word
+            self._write_chunk({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+        self._write_chunk(dict({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}, **stats))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def start_stub(host="127.0.0.1", port=0, latency=0.05, reply="stub reply", token_delay=0.0, tool_calls=None,
+               tool_steps=1, parallel_tools=False, load_time=0.0):
+    """在后台线程启动替身服务器，返回 (server, base_url)
+
+    tool_calls: {工具名: 参数}，请求中提供了该工具时返回对应的工具调用 (可运行时修改 server.tool_calls)
+    tool_steps: 每个用户回合连续返回工具调用的步数；parallel_tools: 一步中返回全部可用的预设工具
+    load_time: 未常驻模型的模拟加载耗时 (秒)；server.loads 记录加载次数
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.reply = reply
+    server.token_delay = token_delay
+    server.tool_calls = dict(tool_calls or {})
+    server.tool_steps = tool_steps
+    server.parallel_tools = parallel_tools
+    server.load_time = load_time
+    server.resident = {}
+    server.loads = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Ollama /api/chat 替身服务器")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="每个请求的模拟生成延迟 (秒)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="流式模式下相邻 token 的间隔 (秒)")
+    parser.add_argument("--tool-call", action="append", default=[], metavar="NAME=JSON",
+                        help='预设工具调用，例如 dispatch_task=\'{"agent_name": "ChatBot", "task_description": "闲聊"}\'')
+    parser.add_argument("--tool-steps", type=int, default=1, help="每个用户回合连续返回工具调用的步数")
+    parser.add_argument("--parallel-tools", action="store_true", help="一步中返回全部可用的预设工具调用")
+    parser.add_argument("--load-time", type=float, default=0.0, help="未常驻模型的模拟加载耗时 (秒)")
+    args = parser.parse_args()
+
+    tool_calls = {}
+    for spec in args.tool_call:
+        name, _, arguments = spec.partition("=")
+        tool_calls[name] = json.loads(arguments or "{}")
+    server, url = start_stub(port=args.port, latency=args.latency, token_delay=args.token_delay, tool_calls=tool_calls,
+                             tool_steps=args.tool_steps, parallel_tools=args.parallel_tools, load_time=args.load_time)
+    print(f"Stub Ollama listening on {url} (latency={args.latency}s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()